@@ -1,8 +1,49 @@
-from ordered_list import OrderedList
+import collections
+import contextlib
+import functools
+import heapq
+import os
+import re
+from array import array
+import struct
+import zlib
+try:
+    import numpy
+except ImportError:  # NumPy is optional, count_bytes falls back to a Python loop without it
+    numpy = None
 from huffman_bit_writer import HuffmanBitWriter
 from huffman_bit_reader import HuffmanBitReader
+from huffman_metrics import NO_METRICS
+
+BUFFER_SIZE = 1 << 20  # characters (or encoded bytes) read from a file at a time
+CANONICAL_PAIRS = 0    # first byte of a canonical file whose header lists (char, length) pairs
+CANONICAL_LENGTHS = 1  # first byte of a canonical file whose header has all 256 code lengths
+ENCODE_CACHE_SIZE = 128  # code tables kept by encode_tables
+DECODE_CACHE_SIZE = 32   # byte decoding tables kept by decode_tables (up to ~2.5 MB each)
+LARGE_CACHE_SIZE = 2     # context and symbol decoding tables kept by decode_large_tables (up to ~40 MB each)
+MODEL_MARKER = 2       # first byte of a file encoded with a registered model instead of a header
+MODEL_ID = struct.Struct('<I')
+CONTEXT_MARKER = 3     # first byte of a file coded with one of several code tables per preceding byte
+CONTEXT_GROUPS = 16    # most code tables in a context file (its decoding table is up to ~40 MB)
+CONTEXT_ROUNDS = 3     # rounds of reassigning contexts to code tables in create_context_model
+
+# code tables of a context file: the table (group) used after each byte value, and the
+# (char, length) pairs of every table
+ContextModel = collections.namedtuple('ContextModel', 'groups lengths')
+SYMBOL_MARKER = 4        # first byte of a file coded over an alphabet of strings (see encode_symbol_file)
+SYMBOL_MAX_LENGTH = 20   # longest code of a symbol file, its decoding table has 2 ** length entries
+WORD_MIN_COUNT = 4       # times a word must occur to become a symbol of its own with symbols='word'
+VECTOR_MAX_LENGTH = 56   # longest code pack_codes handles: a code and its offset in a byte fit in 64 bits
+TOKEN_PATTERNS = {'char': re.compile(r'.', re.DOTALL), 'word': re.compile(r'\w+|\W', re.DOTALL)}
+
+# alphabet of a symbol file: the symbols (strings) in canonical order and their code lengths
+SymbolModel = collections.namedtuple('SymbolModel', 'tokens lengths')
+
+models = {}  # model id -> (header line, frequency tuple) of every registered model (see register_model)
 
 class HuffmanNode:
+    __slots__ = ('char', 'freq', 'left', 'right')   # no per-node __dict__
+
     def __init__(self, char, freq):
         self.char = char   # stored as an integer - the ASCII character code value
         self.freq = freq   # the freqency associated with the node
@@ -24,16 +65,35 @@ class HuffmanNode:
         else:
             return False
 
-def cnt_freq(filename):
+def cnt_freq(filename, buffer_size=BUFFER_SIZE, binary=False):
     '''Opens a text file with a given file name (passed as a string) and counts the 
-    frequency of occurrences of all the characters within that file'''
+    frequency of occurrences of all the characters within that file.
+    The file is read buffer_size characters at a time (all at once if buffer_size is -1)
+    If binary is True the file is read as raw bytes and every byte value is a character;
+    otherwise a character above 255 raises ValueError'''
     char_freq = [0] * 256
-    with open(filename) as file:
-        fileData = file.read()
-        for char in fileData:
-            char_freq[ord(char)] += 1
-    
-    file.close()
+    with open(filename, 'rb' if binary else 'r') as file:
+        fileData = file.read(buffer_size)
+        while fileData:
+            if not binary:
+                try:
+                    fileData = fileData.encode('latin-1')  # characters 0-255 as one byte each
+                except UnicodeEncodeError as error:
+                    raise ValueError("%s has characters above 255, use binary=True or symbols='char'"
+                                     % filename) from error
+            char_freq = [total + count for total, count in zip(char_freq, count_bytes(fileData))]
+            fileData = file.read(buffer_size)
+    return char_freq
+
+def count_bytes(data):
+    '''Returns the frequency list (256 entries) of the byte values in data (a bytes-like object).
+    Uses numpy.bincount when NumPy is installed; without it a plain loop over the bytes measured
+    faster than collections.Counter or one bytes.count call per byte value'''
+    if numpy is not None:
+        return numpy.bincount(numpy.frombuffer(data, dtype=numpy.uint8), minlength=256).tolist()
+    char_freq = [0] * 256
+    for byte in data:
+        char_freq[byte] += 1
     return char_freq
 
 def create_huff_tree(char_freq):
@@ -41,36 +101,650 @@ def create_huff_tree(char_freq):
     Returns the root node of the Huffman tree'''
     
     
-    nodes = OrderedList()
-    for char, freq in enumerate(char_freq):
-        if freq > 0:
-            leaf_node = HuffmanNode(char, freq)
-            nodes.add(leaf_node)
-    
-    while nodes.size() > 1:
-        leftChild = nodes.pop(0)
-        rightChild = nodes.pop(0)
+    # (freq, char) is unique for every node, so the heap orders nodes exactly like HuffmanNode.__lt__
+    nodes = [(freq, char, HuffmanNode(char, freq)) for char, freq in enumerate(char_freq) if freq > 0]
+    heapq.heapify(nodes)
+    while len(nodes) > 1:
+        leftChild = heapq.heappop(nodes)[2]
+        rightChild = heapq.heappop(nodes)[2]
         newInternalNode = HuffmanNode(min(leftChild.char, rightChild.char), leftChild.freq + rightChild.freq)
         newInternalNode.left = leftChild
         newInternalNode.right = rightChild
-        nodes.add(newInternalNode)
+        heapq.heappush(nodes, (newInternalNode.freq, newInternalNode.char, newInternalNode))
 
-    return nodes.pop(0)
+    return heapq.heappop(nodes)[2]
+
+def create_huff_arrays(char_freq):
+    '''Builds the same Huffman tree as create_huff_tree, but as flat arrays instead of HuffmanNode
+    objects. Returns a tree (left, right, root): left and right are array('i')s with the children
+    of every internal node, where a child >= 0 is the index of another internal node and a child
+    < 0 is the leaf ~char. root is the index of the root, ~char if there is only one character
+    and None if there are none'''
+    left = array('i')
+    right = array('i')
+    nodes = [(freq, char, ~char) for char, freq in enumerate(char_freq) if freq > 0]
+    if not nodes:
+        return left, right, None
+    heapq.heapify(nodes)
+    while len(nodes) > 1:
+        leftFreq, leftChar, leftChild = heapq.heappop(nodes)
+        rightFreq, rightChar, rightChild = heapq.heappop(nodes)
+        left.append(leftChild)
+        right.append(rightChild)
+        heapq.heappush(nodes, (leftFreq + rightFreq, min(leftChar, rightChar), len(left) - 1))
+    return left, right, nodes[0][2]
+
+def flatten_tree(node):
+    '''Converts a tree of HuffmanNode objects into the (left, right, root) arrays of
+    create_huff_arrays, numbering the internal nodes in breadth-first order'''
+    left = array('i')
+    right = array('i')
+    if node is None:
+        return left, right, None
+    if node.left is None and node.right is None:
+        return left, right, ~node.char
+    internal = [node]
+    for current in internal:
+        for children, child in ((left, current.left), (right, current.right)):
+            if child.left is None and child.right is None:
+                children.append(~child.char)
+            else:
+                children.append(len(internal))
+                internal.append(child)
+    return left, right, 0
+
+def create_array_code(tree, size=256):
+    '''create_code for a tree of create_huff_arrays: returns the list of Huffman code strings
+    (size of them, enough for every character of the tree)'''
+    left, right, root = tree
+    huffman_codes = [""] * size
+    if root is None:
+        return huffman_codes
+    stack = [(root, '')]
+    while stack:
+        node, code = stack.pop()
+        if node < 0:
+            huffman_codes[~node] = code
+        else:
+            stack.append((right[node], code + '1'))
+            stack.append((left[node], code + '0'))
+    return huffman_codes
 
 def create_code(node):
     '''Returns an array (Python list) of Huffman codes. For each character, use the integer ASCII representation 
     as the index into the arrary, with the resulting Huffman code for that character stored at that location'''
-    def traverse(node, code, result):
-        if node is not None:
-            if node.left is None and node.right is None and node.char is not None:  
-                huffman_codes[node.char] = code
-                return 
-            traverse(node.left, code + '0', result)
-            traverse(node.right, code + '1', result)
     huffman_codes = [""] * 256  # Initialize an array with 256 empty strings
-    traverse(node, '', huffman_codes)
+    # walk the tree with an explicit stack so deep (skewed) trees cannot hit the recursion limit
+    stack = [(node, '')]
+    while stack:
+        node, code = stack.pop()
+        if node is None:
+            continue
+        if node.left is None and node.right is None and node.char is not None:
+            huffman_codes[node.char] = code
+        else:
+            stack.append((node.right, code + '1'))
+            stack.append((node.left, code + '0'))
     return huffman_codes
 
+def create_code_lengths(char_freq, max_length=None):
+    '''Returns the Huffman code length of every character with non-zero frequency, as a list of
+    (char, length) pairs in character order (the input of create_canonical_codes).
+    If max_length is given, no code is longer than max_length bits: the lengths are then computed
+    with the package-merge algorithm, which gives the best possible lengths under that limit.
+    Raises ValueError if max_length bits cannot give every character its own code'''
+    leaves = sorted((freq, char) for char, freq in enumerate(char_freq) if freq > 0)
+    if max_length is None or len(leaves) < 2:
+        codes = create_array_code(create_huff_arrays(char_freq), max(256, len(char_freq)))
+        return [(char, len(codes[char])) for char, freq in enumerate(char_freq) if freq > 0]
+    if len(leaves) > 1 << max_length:
+        raise ValueError("%d characters need codes longer than %d bits" % (len(leaves), max_length))
+
+    # every item is (weight, characters); a package pairs up two items of the level below
+    items = [(freq, [char]) for freq, char in leaves]
+    for level in range(max_length - 1):
+        packages = [(items[index][0] + items[index + 1][0], items[index][1] + items[index + 1][1])
+                    for index in range(0, len(items) - 1, 2)]
+        items = merge_items(leaves, packages)
+    lengths = [0] * len(char_freq)
+    for weight, chars in items[:2 * len(leaves) - 2]:
+        for char in chars:
+            lengths[char] += 1
+    return [(char, length) for char, length in enumerate(lengths) if length > 0]
+
+def merge_items(leaves, packages):
+    '''Merges the sorted (freq, char) leaves with the sorted package items of create_code_lengths
+    into one list ordered by weight, taking leaves first on ties'''
+    merged = []
+    leafIndex = 0
+    for package in packages:
+        while leafIndex < len(leaves) and leaves[leafIndex][0] <= package[0]:
+            merged.append((leaves[leafIndex][0], [leaves[leafIndex][1]]))
+            leafIndex += 1
+        merged.append(package)
+    for freq, char in leaves[leafIndex:]:
+        merged.append((freq, [char]))
+    return merged
+
+def create_code_bits(codes):
+    '''Converts the list of '0'/'1' code strings returned by create_code into a list of
+    (code, length) integer pairs, the form taken by HuffmanBitWriter.write_bits'''
+    return [(int(code, 2) if code else 0, len(code)) for code in codes]
+
+def create_code_strings(codeBits):
+    '''The reverse of create_code_bits: converts (code, length) pairs into '0'/'1' code strings'''
+    return [format(code, '0%db' % length) if length else '' for code, length in codeBits]
+
+def create_code_arrays(codeBits):
+    '''Returns the (code, length) pairs of codeBits as two NumPy arrays, the form taken by
+    pack_codes, or None if NumPy is not installed or a code is longer than VECTOR_MAX_LENGTH bits
+    (the caller then writes the codes one at a time with write_bits)'''
+    if numpy is None or max(length for code, length in codeBits) > VECTOR_MAX_LENGTH:
+        return None
+    codes, lengths = zip(*codeBits)
+    return numpy.array(codes, dtype=numpy.uint64), numpy.array(lengths, dtype=numpy.int64)
+
+def pack_codes(bitWriter, codeArrays, data, previous=None):
+    '''Writes the codes of the bytes of data (a bytes-like object) with bitWriter: the same bits
+    as calling bitWriter.write_bits(*codeBits[byte]) for every byte, without a Python loop.
+    The codes and lengths of all the bytes are looked up at once, a cumulative sum of the lengths
+    gives the bit offset of every code, and each code is shifted into the 64-bit word starting at
+    the byte it begins in. Codes beginning in the same byte are OR-ed together (their bits do not
+    overlap) and the words are OR-ed byte by byte into the output.
+    codeArrays comes from create_code_arrays. For the 65536 codes of a context file, previous is
+    the byte before data (0 at the start of the file) and each code is chosen by the byte before it'''
+    if not data:
+        return
+    codes, lengths = codeArrays
+    indexes = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int64)
+    if previous is not None:
+        contexts = indexes[:-1] << 8
+        indexes[1:] |= contexts
+        indexes[0] |= previous << 8
+    codeLengths = lengths[indexes]
+    # whole bytes pending in the writer go straight to its buffer, the rest go in front of the codes
+    spare = bitWriter.n_bits % 8
+    head = (bitWriter.bits >> spare).to_bytes(bitWriter.n_bits // 8, 'big')
+    ends = numpy.cumsum(codeLengths)
+    ends += spare
+    starts = ends - codeLengths
+    total = int(ends[-1])
+    firstBytes = starts >> 3
+    words = codes[indexes] << (64 - (starts & 7) - codeLengths).astype(numpy.uint64)
+    groups = numpy.flatnonzero(numpy.diff(firstBytes)) + 1
+    groups = numpy.concatenate(([0], groups))
+    words = numpy.bitwise_or.reduceat(words, groups)
+    firstBytes = firstBytes[groups]
+    packed = numpy.zeros(total // 8 + 8, dtype=numpy.uint8)
+    packed[0] = (bitWriter.bits & ((1 << spare) - 1)) << (8 - spare)
+    for byte in range((7 + int(codeLengths.max()) + 7) // 8):
+        packed[firstBytes + byte] |= (words >> numpy.uint64(56 - 8 * byte)).astype(numpy.uint8)
+    bitWriter.bits = 0
+    bitWriter.n_bits = 0
+    bitWriter.write_bytes(head)
+    bitWriter.write_bytes(packed[:total // 8].tobytes())
+    bitWriter.n_bits = total % 8
+    bitWriter.bits = int(packed[total // 8]) >> (8 - bitWriter.n_bits)
+
+def create_decode_table(node):
+    '''Returns a lookup table that decodes a whole byte (8 bits) of encoded data per lookup.
+    Every internal node of the Huffman tree is a decoder state (the root is state 0). The entry
+    at index state * 256 + byte is a tuple (chars, next_state): the characters completed while
+    walking the 8 bits of byte from that state, and the state the walk ends in.
+    Returns None if the tree is a single leaf (no bits are needed to decode it)'''
+    return create_array_decode_table(flatten_tree(node))
+
+def create_array_decode_table(tree):
+    '''create_decode_table for a tree of create_huff_arrays'''
+    left, right, root = tree
+    if root is None or root < 0:
+        return None
+    # decoder states are the internal nodes in breadth-first order from the root
+    states = [root]
+    stateIds = {root: 0}
+    for node in states:
+        for child in (left[node], right[node]):
+            if child >= 0:
+                stateIds[child] = len(states)
+                states.append(child)
+
+    # one bit at a time: following a child either completes a character or moves to a state
+    table = []
+    for node in states:
+        for child in (left[node], right[node]):
+            if child < 0:
+                table.append((chr(~child), 0))
+            else:
+                table.append(('', stateIds[child]))
+    return expand_decode_table(table)
+
+def expand_decode_table(table):
+    '''Takes a one-bit decoding table (entry state * 2 + bit is the (chars, next_state) reached by
+    following bit from state) and returns the equivalent whole-byte table of create_decode_table'''
+    stateCount = len(table) // 2
+    # double the number of bits per lookup until a whole byte is consumed at once
+    bits = 1
+    while bits < 8:
+        width = 1 << bits
+        doubled = []
+        for state in range(stateCount):
+            for high in range(width):
+                chars, nextState = table[state * width + high]
+                for low in range(width):
+                    moreChars, lastState = table[nextState * width + low]
+                    doubled.append((chars + moreChars, lastState))
+        table = doubled
+        bits *= 2
+    return table
+
+def create_canonical_codes(lengths):
+    '''Input is a list of (char, code length) pairs. Returns the canonical Huffman codes for those
+    lengths as a list of 256 (code, length) pairs, like create_code_bits: characters are sorted by
+    code length then by character, and each gets the next binary number of its length.
+    Characters above 255 (the symbol indexes of a symbol file) make the list longer'''
+    codeBits = [(0, 0)] * max([256] + [char + 1 for char, length in lengths])
+    code = 0
+    previousLength = 0
+    for length, char in sorted((length, char) for char, length in lengths):
+        code <<= length - previousLength
+        codeBits[char] = (code, length)
+        code += 1
+        previousLength = length
+    return codeBits
+
+def create_canonical_decode_table(codeBits):
+    '''Returns the whole-byte decoding table (see create_decode_table) for a list of (code, length)
+    pairs as returned by create_canonical_codes, built straight from the codes without creating
+    HuffmanNode objects. Returns None if no bits are needed (a single character of length 0)'''
+    table = create_canonical_bit_table(codeBits)
+    if table == [None, None]:
+        return None
+    # bit patterns that no code uses can only come from a damaged file, decode them to nothing
+    return expand_decode_table([('', 0) if entry is None else entry for entry in table])
+
+def create_canonical_bit_table(codeBits):
+    '''Returns the one-bit decoding table (see expand_decode_table) of the codes in codeBits, with
+    None for the bit patterns that no code uses'''
+    table = [None, None]
+    for char, (code, length) in enumerate(codeBits):
+        if length == 0:
+            continue
+        state = 0
+        for shift in range(length - 1, 0, -1):
+            entry = state * 2 + ((code >> shift) & 1)
+            if table[entry] is None:
+                table[entry] = ('', len(table) // 2)
+                table += [None, None]
+            state = table[entry][1]
+        table[state * 2 + (code & 1)] = (chr(char), 0)
+    return table
+
+def create_canonical_header(lengths, charCount):
+    '''Input is a list of (char, code length) pairs and the number of characters encoded.
+    Returns the binary header (bytes) of a canonical Huffman file:
+    a marker byte, the character count as a variable-length integer (7 bits per byte, least
+    significant first), then either the number of characters minus one followed by (char, length)
+    byte pairs (marker CANONICAL_PAIRS) or all 256 lengths with 0 for unused characters
+    (marker CANONICAL_LENGTHS), whichever is shorter'''
+    count = encode_varint(charCount)
+    if len(lengths) * 2 + 1 <= 256:
+        body = bytearray([len(lengths) - 1])
+        for char, length in lengths:
+            body += bytes([char, length])
+        return bytes([CANONICAL_PAIRS]) + count + body
+    body = bytearray(256)
+    for char, length in lengths:
+        body[char] = length
+    return bytes([CANONICAL_LENGTHS]) + count + body
+
+def parse_canonical_header(marker, reader):
+    '''Reads the rest of a canonical header (after its marker byte) from reader.
+    Returns the list of (char, code length) pairs and the number of characters encoded'''
+    charCount = read_varint(reader)
+    if marker == CANONICAL_PAIRS:
+        size = 2 * (reader.read_byte() + 1)
+        body = reader.read_bytes(size)
+        lengths = [(body[index], body[index + 1]) for index in range(0, len(body), 2)]
+    else:
+        size = 256
+        body = reader.read_bytes(size)
+        lengths = [(char, length) for char, length in enumerate(body) if length > 0]
+    if len(body) < size or not lengths:
+        raise ValueError("truncated or damaged canonical header")
+    return lengths, charCount
+
+def cnt_pair_freq(filename, buffer_size=BUFFER_SIZE, binary=False):
+    '''Like cnt_freq, but counts every character together with the character before it (byte 0
+    before the first). Returns a list of 65536 frequencies: entry (previous << 8) | char.
+    The frequency list of cnt_freq is the sum of the 256 slices of 256 entries'''
+    pair_freq = [0] * 65536
+    context = 0
+    with open(filename, 'rb' if binary else 'r') as file:
+        fileData = file.read(buffer_size)
+        while fileData:
+            if not binary:
+                try:
+                    fileData = fileData.encode('latin-1')
+                except UnicodeEncodeError as error:
+                    raise ValueError("%s has characters above 255, use binary=True" % filename) from error
+            for byte in fileData:
+                pair_freq[context | byte] += 1
+                context = byte << 8
+            fileData = file.read(buffer_size)
+    return pair_freq
+
+def create_context_lengths(char_freq, max_length=None):
+    '''create_code_lengths for one code table of a context file: a table with a single character
+    gives it a 1-bit code, since the decoder can only emit characters as it reads bits'''
+    lengths = create_code_lengths(char_freq, max_length)
+    if len(lengths) == 1:
+        lengths = [(lengths[0][0], 1)]
+    return lengths
+
+def create_context_model(pair_freq, group_count=CONTEXT_GROUPS, max_code_length=None):
+    '''Builds the code tables of an order-1 context file from the pair frequencies of cnt_pair_freq.
+    Every preceding byte value (context) with its own character frequencies would need its own
+    table, which makes for large headers and decoding tables, so contexts are grouped: the
+    group_count - 1 most frequent contexts start their own groups and a last group starts with the
+    frequencies of all contexts, which can code everything. Each context then joins the group
+    whose code codes it in the fewest bits and the codes are rebuilt from the members of each
+    group, for CONTEXT_ROUNDS rounds. Groups are numbered in order of the first context using them,
+    so context 0 (the start of the file) uses group 0. Returns a ContextModel'''
+    contexts = [[(char, freq) for char, freq in enumerate(pair_freq[context << 8:(context + 1) << 8]) if freq]
+                for context in range(256)]
+    used = [context for context in range(256) if contexts[context]]
+    seeds = sorted(used, key=lambda context: -sum(freq for char, freq in contexts[context]))[:group_count - 1]
+    groupFreqs = []
+    for context in seeds:
+        freqs = [0] * 256
+        for char, freq in contexts[context]:
+            freqs[char] = freq
+        groupFreqs.append(freqs)
+    groupFreqs.append([sum(pair_freq[char::256]) for char in range(256)])
+
+    groups = [0] * 256
+    for round in range(CONTEXT_ROUNDS):
+        lengthLists = []
+        for freqs in groupFreqs:
+            lengthList = [0] * 256
+            for char, length in create_context_lengths(freqs, max_code_length):
+                lengthList[char] = length
+            lengthLists.append(lengthList)
+        choices = {}
+        for context in used:
+            best = None
+            for group, lengthList in enumerate(lengthLists):
+                if all(lengthList[char] for char, freq in contexts[context]):
+                    bits = sum(freq * lengthList[char] for char, freq in contexts[context])
+                    if best is None or bits < best[0]:
+                        best = (bits, group)
+            choices[context] = best[1]
+        # renumber the groups that are still used, in order of their first context
+        numbers = {}
+        for context in used:
+            numbers.setdefault(choices[context], len(numbers))
+        groupFreqs = [[0] * 256 for number in numbers]
+        for context in used:
+            groups[context] = numbers[choices[context]]
+            freqs = groupFreqs[groups[context]]
+            for char, freq in contexts[context]:
+                freqs[char] += freq
+    return ContextModel(bytes(groups), tuple(tuple(create_context_lengths(freqs, max_code_length))
+                                             for freqs in groupFreqs))
+
+def context_size(model, pair_freq):
+    '''Returns the size in bytes of a context file with the given model and pair frequencies'''
+    bits = 0
+    for context in range(256):
+        lengthList = dict(model.lengths[model.groups[context]])
+        bits += sum(freq * lengthList[char] for char, freq in enumerate(pair_freq[context << 8:(context + 1) << 8])
+                    if freq)
+    return len(create_context_header(model, sum(pair_freq))) + (bits + 7) // 8
+
+def choose_context_model(pair_freq, max_code_length=None):
+    '''Returns the context model with 2, 4, ... CONTEXT_GROUPS code tables that gives the
+    smallest file, or None if a canonical order-0 file would be no larger'''
+    frequencies = [sum(pair_freq[char::256]) for char in range(256)]
+    lengths = create_code_lengths(frequencies, max_code_length)
+    lengthList = dict(lengths)
+    best = (len(create_canonical_header(lengths, sum(frequencies)))
+            + (sum(freq * lengthList[char] for char, freq in enumerate(frequencies) if freq) + 7) // 8, None)
+    group_count = 2
+    while group_count <= CONTEXT_GROUPS:
+        model = create_context_model(pair_freq, group_count, max_code_length)
+        size = context_size(model, pair_freq)
+        if size < best[0]:
+            best = (size, model)
+        group_count *= 2
+    return best[1]
+
+def create_context_header(model, charCount):
+    '''Returns the binary header (bytes) of a context file: the marker CONTEXT_MARKER, the
+    character count as a varint, the number of code tables minus one, the table used after each
+    of the 256 byte values and then the lengths of every table, each written as a canonical
+    header with a count of 0 (see create_canonical_header)'''
+    header = bytearray([CONTEXT_MARKER])
+    header += encode_varint(charCount)
+    header.append(len(model.lengths) - 1)
+    header += model.groups
+    for lengths in model.lengths:
+        header += create_canonical_header(lengths, 0)
+    return bytes(header)
+
+def parse_context_header(reader):
+    '''Reads the rest of a context header (after its marker byte) from reader.
+    Returns the ContextModel and the number of characters encoded'''
+    charCount = read_varint(reader)
+    groupCount = reader.read_byte() + 1
+    groups = reader.read_bytes(256)
+    if len(groups) < 256 or max(groups) >= groupCount:
+        raise ValueError("damaged context header: the table of a context is missing")
+    lengths = []
+    for group in range(groupCount):
+        lengths.append(tuple(parse_canonical_header(reader.read_byte(), reader)[0]))
+    return ContextModel(groups, tuple(lengths)), charCount
+
+def create_context_codes(model):
+    '''Returns the (code, length) pair of every character after every context, as a list of 65536
+    pairs indexed like cnt_pair_freq: entry (previous << 8) | char'''
+    groupCodes = [create_canonical_codes(lengths) for lengths in model.lengths]
+    return [pair for group in model.groups for pair in groupCodes[group]]
+
+def create_context_decode_table(model):
+    '''Returns the whole-byte decoding table (see create_decode_table) of a context file. The
+    decoder states of all code tables are numbered one after the other, and completing a
+    character moves to the root state of the table of that character's context, so the context
+    switches happen inside the table and a byte is still decoded with a single lookup'''
+    bitTables = [create_canonical_bit_table(create_canonical_codes(lengths)) for lengths in model.lengths]
+    roots = []
+    stateCount = 0
+    for bitTable in bitTables:
+        roots.append(stateCount)
+        stateCount += len(bitTable) // 2
+    table = []
+    for root, bitTable in zip(roots, bitTables):
+        for entry in bitTable:
+            if entry is None:
+                table.append(('', 0))
+            elif entry[0]:
+                table.append((entry[0], roots[model.groups[ord(entry[0])]]))
+            else:
+                table.append(('', root + entry[1]))
+    # the tables of different groups end up with many equal entries: sharing one tuple for each
+    # saves most of the memory and makes lookups as cache friendly as with a single table
+    entries = {}
+    return [entries.setdefault(entry, entry) for entry in expand_decode_table(table)]
+
+def create_context_text(model):
+    '''Returns the header line written to the text output file for a context file'''
+    return 'context %s | %s' % (' '.join(map(str, model.groups)),
+                                ' | '.join(' '.join('%d %d' % pair for pair in lengths) for lengths in model.lengths))
+
+def translate_context(text, codeStrings, context):
+    '''Returns the '0'/'1' codes of text, coded after the character context (a byte value), using
+    the code strings of all 65536 (previous << 8) | char pairs'''
+    codes = []
+    context <<= 8
+    for char in text:
+        code = ord(char)
+        codes.append(codeStrings[context | code])
+        context = code << 8
+    return ''.join(codes)
+
+def cnt_symbols(filename, symbols, buffer_size=BUFFER_SIZE):
+    '''Counts the symbols of a text file of any characters for encode_symbol_file. With symbols
+    'char' every character (code point) is a symbol; with 'word' every run of word characters
+    that occurs at least WORD_MIN_COUNT times is one symbol and all other characters are
+    symbols of their own. Returns a dict of symbol -> frequency'''
+    pattern = TOKEN_PATTERNS[symbols]
+    counts = collections.Counter()
+    with open(filename) as file:
+        fileString = file.read(buffer_size)
+        while fileString:
+            if symbols == 'char':
+                counts.update(fileString)
+            else:
+                counts.update(pattern.findall(fileString))
+            fileString = file.read(buffer_size)
+    for token, count in list(counts.items()):
+        if len(token) > 1 and count < WORD_MIN_COUNT:
+            del counts[token]
+            for char in token:
+                counts[char] += count
+    return dict(counts)
+
+def create_symbol_model(symbol_freq, max_code_length=None):
+    '''Returns the SymbolModel for a dict of symbol -> frequency: the symbols sorted by code
+    length, then by symbol, with their lengths. Codes are at most max_code_length bits, and
+    never more than SYMBOL_MAX_LENGTH'''
+    tokens = sorted(symbol_freq)
+    freqs = [symbol_freq[token] for token in tokens]
+    limit = min(max_code_length or SYMBOL_MAX_LENGTH, SYMBOL_MAX_LENGTH)
+    lengths = create_code_lengths(freqs)
+    if max(length for index, length in lengths) > limit:
+        lengths = create_code_lengths(freqs, limit)
+    order = sorted((length, tokens[index]) for index, length in lengths)
+    return SymbolModel(tuple(token for length, token in order), tuple(length for length, token in order))
+
+def create_symbol_header(model, symbolCount):
+    '''Returns the binary header (bytes) of a symbol file: the marker SYMBOL_MARKER, then as
+    varints the number of symbols encoded, the size of the alphabet, the longest code length and
+    the number of codes of every length from 1 up, then every symbol in canonical order as the
+    varint size of its UTF-8 encoding followed by the encoding. Symbols are never sorted or
+    numbered by value, so the header grows with the alphabet, not with the largest code point'''
+    header = bytearray([SYMBOL_MARKER])
+    header += encode_varint(symbolCount)
+    header += encode_varint(len(model.tokens))
+    maxLength = model.lengths[-1]
+    header += encode_varint(maxLength)
+    for length in range(1, maxLength + 1):
+        header += encode_varint(model.lengths.count(length))
+    for token in model.tokens:
+        data = token.encode('utf-8')
+        header += encode_varint(len(data))
+        header += data
+    return bytes(header)
+
+def parse_symbol_header(reader):
+    '''Reads the rest of a symbol header (after its marker byte) from reader.
+    Returns the SymbolModel and the number of symbols encoded'''
+    symbolCount = read_varint(reader)
+    tokenCount = read_varint(reader)
+    maxLength = read_varint(reader)
+    if maxLength > SYMBOL_MAX_LENGTH:
+        raise ValueError("damaged symbol header: codes of %d bits" % maxLength)
+    counts = [read_varint(reader) for length in range(1, maxLength + 1)]
+    # the encoder always writes a complete code set (every bit pattern starts a code), so check
+    # that before building the lists, which a damaged count could make huge
+    kraftSum = sum(count << (maxLength - length) for length, count in enumerate(counts, 1))
+    if (sum(counts) if maxLength else 1) != tokenCount or (maxLength and kraftSum != 1 << maxLength):
+        raise ValueError("damaged symbol header: %d symbols do not fit the code lengths" % tokenCount)
+    lengths = []
+    for length, count in enumerate(counts, 1):
+        lengths += [length] * count
+    if not lengths:
+        lengths = [0]   # a single symbol needs no bits
+    tokens = []
+    for index in range(tokenCount):
+        size = read_varint(reader)
+        data = reader.read_bytes(size)
+        if len(data) < size:
+            raise ValueError("truncated symbol header")
+        tokens.append(data.decode('utf-8'))
+    return SymbolModel(tuple(tokens), tuple(lengths)), symbolCount
+
+def create_symbol_codes(model):
+    '''Returns a dict of symbol -> (code, length) pair for a SymbolModel'''
+    codeBits = create_canonical_codes(list(enumerate(model.lengths)))
+    return {token: codeBits[index] for index, token in enumerate(model.tokens)}
+
+def create_symbol_decode_table(model):
+    '''Returns the decoding table of a symbol file: a list of 2 ** width entries, where width is
+    the longest code length. The entry for the next width bits of the encoded data is (index,
+    length): the symbol whose code starts those bits, as chr(index) of its place in the alphabet,
+    and its code length. Returns None for a single symbol (no bits are needed)'''
+    width = model.lengths[-1]
+    if width == 0:
+        return None
+    table = [None] * (1 << width)
+    codeBits = create_canonical_codes(list(enumerate(model.lengths)))
+    for index, length in enumerate(model.lengths):
+        span = 1 << (width - length)
+        start = codeBits[index][0] << (width - length)
+        table[start:start + span] = [(chr(index), length)] * span
+    return table
+
+def encode_varint(number):
+    '''Returns a non-negative integer as a variable-length integer (bytes): 7 bits per byte, least
+    significant first, with the high bit set on every byte but the last'''
+    data = bytearray()
+    while number >= 0x80:
+        data.append(0x80 | (number & 0x7F))
+        number >>= 7
+    data.append(number)
+    return bytes(data)
+
+def read_varint(reader):
+    '''Reads a variable-length integer written by encode_varint from reader'''
+    number = 0
+    shift = 0
+    byte = 0x80
+    while byte & 0x80:
+        data = reader.read_bytes(1)
+        if not data:
+            raise ValueError("truncated file: it ends inside a number")
+        byte = data[0]
+        number |= (byte & 0x7F) << shift
+        shift += 7
+    return number
+
+def train_model(filenames, binary=False):
+    '''Counts the characters of all the given files (see cnt_freq) and returns the frequency list
+    of a shared model for them. Every count is one more than in the files, so the model can encode
+    any character, including those that never appear in the training files'''
+    char_freq = [1] * 256
+    for filename in filenames:
+        char_freq = [total + count for total, count in zip(char_freq, cnt_freq(filename, binary=binary))]
+    return char_freq
+
+def save_model(char_freq, model_file):
+    '''Writes a model frequency list to model_file as a header line (see create_header)'''
+    with open(model_file, 'w') as file:
+        file.write(create_header(char_freq) + "\n")
+
+def load_model(model_file):
+    '''Reads a model written by save_model, registers it and returns its model id'''
+    with open(model_file) as file:
+        return register_model(parse_header(file.readline()))
+
+def register_model(char_freq):
+    '''Makes a model frequency list available to huffman_encode and huffman_decode and returns
+    its model id, the CRC-32 of its header line. Files encoded with a model store only the id,
+    so the model must be registered again (e.g. with load_model) before they are decoded'''
+    header = create_header(char_freq)
+    modelId = zlib.crc32(header.encode('utf-8'))
+    models[modelId] = (header, tuple(char_freq))
+    return modelId
 
 def create_header(freqs):
     '''Input is the list of frequencies. Creates and returns a header for the output file
@@ -85,108 +759,481 @@ def create_header(freqs):
     header = ' '.join(header)                
     return str(header.strip())
 
-def testEmpty(in_file, out_file):
-    try:
-        with open(in_file, 'r') as inputFile:
-            fileString = inputFile.read()
-            if not fileString:
-                fileString = open(out_file, 'w')
-                fileString.write('')
-
-                compressedFile = out_file.replace('.txt', '_compressed.txt')
-                bitWriter = HuffmanBitWriter(compressedFile)
-                bitWriter.write_code('')
-                bitWriter.close()
-                inputFile.close()
-                fileString.close()
-                return None
-            return fileString    
-    except FileNotFoundError:
-        raise FileNotFoundError
-    
-def huffman_encode(in_file, out_file):
+@functools.lru_cache(maxsize=ENCODE_CACHE_SIZE)
+def encode_tables(frequencies, canonical=False, max_code_length=None):
+    '''Returns the code tables for a tuple of 256 frequencies as (codeKey, codeBits, lengths):
+    the '0'/'1' code strings (as from create_code), the (code, length) pairs (as from
+    create_code_bits) and, for canonical codes, the (char, length) pairs (None otherwise).
+    Results are kept in a bounded least-recently-used cache, so inputs with the same frequencies
+    skip building the tree and the codes; see table_cache_info for the hit and miss counts.
+    The returned lists are shared between callers and must not be changed'''
+    if canonical:
+        lengths = create_code_lengths(frequencies, max_code_length)
+        codeBits = create_canonical_codes(lengths)
+        return create_code_strings(codeBits), codeBits, lengths
+    codeKey = create_array_code(create_huff_arrays(frequencies))
+    return codeKey, create_code_bits(codeKey), None
+
+def decode_tables(header):
+    '''Returns (table, onlyChar) for decoding a file with the given header: the whole-byte
+    decoding table (None if no bits are needed) and the character of a single-character file.
+    header is the frequency line of a huffman_encode file, or the tuple of (char, length) pairs
+    of a canonical file, or the ContextModel or SymbolModel of a context or symbol file.
+    Results are cached like those of encode_tables. The tables of context and symbol files are
+    ten times the size of the others or more, so they have a cache of their own that keeps only
+    LARGE_CACHE_SIZE of them (see decode_large_tables)'''
+    if isinstance(header, (ContextModel, SymbolModel)):
+        return decode_large_tables(header)
+    return decode_byte_tables(header)
+
+@functools.lru_cache(maxsize=DECODE_CACHE_SIZE)
+def decode_byte_tables(header):
+    '''decode_tables for a frequency line or canonical (char, length) pairs'''
+    if isinstance(header, str):
+        left, right, root = tree = create_huff_arrays(parse_header(header))
+        return create_array_decode_table(tree), ~root if root < 0 else None
+    return create_canonical_decode_table(create_canonical_codes(header)), header[0][0]
+
+@functools.lru_cache(maxsize=LARGE_CACHE_SIZE)
+def decode_large_tables(header):
+    '''decode_tables for a ContextModel or SymbolModel'''
+    if isinstance(header, ContextModel):
+        return create_context_decode_table(header), None
+    return create_symbol_decode_table(header), 0
+
+def table_cache_info():
+    '''Returns the hit/miss statistics of the encode_tables cache and of the two decode_tables
+    caches: 'decode' for frequency line and canonical files, 'decode_large' for context and
+    symbol files'''
+    return {'encode': encode_tables.cache_info(), 'decode': decode_byte_tables.cache_info(),
+            'decode_large': decode_large_tables.cache_info()}
+
+def clear_table_caches():
+    '''Empties the encode_tables and decode_tables caches and resets their statistics'''
+    encode_tables.cache_clear()
+    decode_byte_tables.cache_clear()
+    decode_large_tables.cache_clear()
+
+def huffman_encode(in_file, out_file, buffer_size=BUFFER_SIZE, canonical=False, max_code_length=None,
+                   binary=False, model=None, text_output=True, metrics=None, context=False, symbols=None,
+                   vectorize=None):
     '''Takes inout file name and output file name as parameters - both files will have .txt extensions
     Uses the Huffman coding process on the text from the input file and writes encoded text to output file
-    Also creates a second output file which adds _compressed before the .txt extension to the name of the file.
+    Also creates a second output file which adds _compressed before the .txt extension to the name of the file
+    (see compressed_name).
     This second file is actually compressed by writing individual 0 and 1 bits to the file using the utility methods 
     provided in the huffman_bits_io module to write both the header and bits.
-    Take not of special cases - empty file and file with only one unique character'''
+    Take not of special cases - empty file and file with only one unique character
+    With text_output=False only the compressed file is written (out_file itself is not); the text
+    form can still be produced later from the compressed file with dump_code.
+    With symbols='char' or 'word' the text may have any characters, see encode_symbol_file
+    The other parameters are described in encode_file, which does the work'''
+    compressedFile = compressed_name(out_file)
+    textFile = out_file if text_output else None
+    if symbols is not None:
+        if canonical or context or binary or model is not None:
+            raise ValueError("symbols cannot be combined with canonical, context, binary or model")
+        encode_symbol_file(in_file, compressedFile, textFile, symbols, buffer_size, max_code_length, metrics)
+        return
+    encode_file(in_file, compressedFile, textFile, buffer_size, canonical, max_code_length, binary, model,
+                metrics, context, vectorize)
+
+def compressed_name(out_file):
+    '''Returns the name of the compressed file that goes with the text output file out_file:
+    _compressed added before its extension (x_out.txt -> x_out_compressed.txt)'''
+    root, extension = os.path.splitext(out_file)
+    return root + '_compressed' + extension
+
+@contextlib.contextmanager
+def open_outputs(compressed_file, text_file, metrics=NO_METRICS):
+    '''Context manager that opens compressed_file as a HuffmanBitWriter and text_file (if not
+    None) for the text output, and yields them as (bitWriter, outputFile). Both are closed at
+    the end; if the body raises, the partly written files are removed as well.
+    Raises ValueError, before opening either, if they are the same file'''
+    if text_file is not None and os.path.abspath(text_file) == os.path.abspath(compressed_file):
+        raise ValueError("the text output and compressed file are both %s" % compressed_file)
+    bitWriter = HuffmanBitWriter(metrics.wrap(open(compressed_file, 'wb')))
+    outputFile = None
+    try:
+        if text_file is not None:
+            outputFile = metrics.wrap(open(text_file, 'w'), 'text')
+        yield bitWriter, outputFile
+    except BaseException:
+        for file, path in ((bitWriter.file, compressed_file), (outputFile, text_file)):
+            if file is not None:
+                file.close()
+                os.remove(path)
+        raise
+    if outputFile is not None:
+        outputFile.close()
+    bitWriter.close()
+
+def encode_file(in_file, compressed_file, text_file=None, buffer_size=BUFFER_SIZE, canonical=False,
+                max_code_length=None, binary=False, model=None, metrics=None, context=False, vectorize=None):
+    '''Huffman codes in_file into compressed_file. If text_file is given, the header and the codes
+    are also written to it as text ('0'/'1' characters), like the output file of huffman_encode.
+    The input file is streamed twice, buffer_size characters at a time: once to count the
+    frequencies and once to write the codes, so it is never held in memory as a whole
+    If canonical is True, canonical codes are used and the compressed file starts with the compact
+    binary header of create_canonical_header instead of the frequency line (the text output file
+    then starts with a line of char/code length pairs)
+    max_code_length limits the length of canonical codes (see create_code_lengths)
+    If binary is True the input is read as raw bytes, so any file can be encoded (see cnt_freq);
+    decode it with binary=True as well to get the same bytes back
+    If model is the id of a registered model (see register_model), the codes come from that model
+    and the compressed file stores only the model id and character count instead of a header
+    If metrics is a huffman_metrics.Metrics object, the time and size of the stages count,
+    tables (building the tree and the codes, unless cached), read, pack (coding and bit packing),
+    write and text (the text output file) are recorded in it
+    If context is True, each character is coded with a code table chosen by the character before
+    it (see create_context_model), which codes text in fewer bits than a single table. The file
+    then starts with the header of create_context_header; if that would not make it smaller, the
+    file is written as with canonical=True instead. max_code_length applies to all code tables
+    vectorize chooses how the codes are packed: with NumPy each buffer is coded in bulk by
+    pack_codes, otherwise one character at a time with write_bits. Both give the same file.
+    None (the default) uses NumPy when it is installed, True requires it and False never uses it'''
     
+    if max_code_length is not None and not (canonical or context):
+        raise ValueError("max_code_length needs canonical=True")
+    if model is not None and (canonical or context):
+        raise ValueError("a model replaces the header, it cannot be combined with canonical or context")
+    if model is not None and model not in models:
+        raise ValueError("unknown model id %d, register or load the model first" % model)
+    if vectorize and numpy is None:
+        raise ValueError("vectorize=True needs NumPy")
+    if metrics is None:
+        metrics = NO_METRICS
+    metrics.begin('encode')
+    with metrics.stage('count'):
+        if context:
+            pairFreq = cnt_pair_freq(in_file, buffer_size, binary)
+            frequencies = [sum(pairFreq[char::256]) for char in range(256)]
+        else:
+            frequencies = cnt_freq(in_file, buffer_size, binary)
+    metrics.count('count', sum(frequencies))
+    if model is not None:
+        modelFreq = models[model][1]
+        if any(freq and not modelFreq[char] for char, freq in enumerate(frequencies)):
+            raise ValueError("%s has characters that model %d cannot encode" % (in_file, model))
+
     #Edge cases
+    if not any(frequencies):
+        with open_outputs(compressed_file, text_file, metrics):
+            pass
+        metrics.finish()
+        return
+
+    #Everything else: the tables are built before any output is opened, so a code length limit
+    #that is too small leaves no files behind
+    with metrics.stage('tables'):
+        contextModel = choose_context_model(pairFreq, max_code_length) if context else None
+        if model is not None:
+            codeKey, codeBits, lengths = encode_tables(modelFreq)
+        elif contextModel is not None:
+            codeBits = create_context_codes(contextModel)   # indexed by (previous << 8) | char
+            codeKey = create_code_strings(codeBits) if text_file is not None else None
+        else:
+            codeKey, codeBits, lengths = encode_tables(tuple(frequencies), canonical or context, max_code_length)
+    with open_outputs(compressed_file, text_file, metrics) as (bitWriter, outputFile):
+        if model is not None:
+            header = 'model %d' % model
+            bitWriter.write_bytes(bytes([MODEL_MARKER]) + MODEL_ID.pack(model) + encode_varint(sum(frequencies)))
+        elif contextModel is not None:
+            header = create_context_text(contextModel)
+            bitWriter.write_bytes(create_context_header(contextModel, sum(frequencies)))
+        elif canonical or context:
+            header = ' '.join('%d %d' % pair for pair in lengths)
+            bitWriter.write_bytes(create_canonical_header(lengths, sum(frequencies)))
+        else:
+            header = create_header(frequencies)
+            bitWriter.write_str(header + "\n")
+
+        if outputFile is not None:
+            outputFile.write(header)
+            outputFile.write("\n")
+        write_bits = bitWriter.write_bits
+        codeArrays = create_code_arrays(codeBits) if vectorize is not False else None
+        with metrics.stage('pack'), open(in_file, 'rb' if binary else 'r') as inputFile:
+            inputFile = metrics.wrap(inputFile)
+            fileString = inputFile.read(buffer_size)
+            previous = 0   # the context, shifted to index codeBits in context mode
+            while fileString:
+                if binary:
+                    data = fileString
+                    fileString = fileString.decode('latin-1')  # one character per byte value
+                elif codeArrays is not None:
+                    data = fileString.encode('latin-1')
+                if codeArrays is not None:
+                    if outputFile is not None:
+                        outputFile.write(translate_context(fileString, codeKey, previous >> 8)
+                                         if contextModel is not None else fileString.translate(codeKey))
+                    pack_codes(bitWriter, codeArrays, data, previous >> 8 if contextModel is not None else None)
+                    previous = data[-1] << 8
+                elif contextModel is not None:
+                    if outputFile is not None:
+                        outputFile.write(translate_context(fileString, codeKey, previous >> 8))
+                    for char in fileString:
+                        code = ord(char)
+                        write_bits(*codeBits[previous | code])
+                        previous = code << 8
+                else:
+                    if outputFile is not None:
+                        outputFile.write(fileString.translate(codeKey))
+                    for char in fileString:
+                        write_bits(*codeBits[ord(char)])
+                fileString = inputFile.read(buffer_size)
+        counts = pairFreq if contextModel is not None else frequencies
+        metrics.count('pack', bits=sum(freq * codeBits[char][1] for char, freq in enumerate(counts) if freq))
+    metrics.finish()
+
+def encode_symbol_file(in_file, compressed_file, text_file=None, symbols='char', buffer_size=BUFFER_SIZE,
+                       max_code_length=None, metrics=None):
+    '''Huffman codes the text file in_file into compressed_file over an alphabet of strings
+    instead of the 256 byte values, so any Unicode text can be coded: every character is a
+    symbol (symbols='char'), or frequent words are symbols as well (symbols='word'), which codes
+    several characters per symbol. See cnt_symbols for the alphabet and create_symbol_header for
+    the header. text_file, buffer_size, max_code_length and metrics are as in encode_file'''
+    if symbols not in TOKEN_PATTERNS:
+        raise ValueError("symbols must be one of %s" % ', '.join(sorted(TOKEN_PATTERNS)))
+    if metrics is None:
+        metrics = NO_METRICS
+    metrics.begin('encode')
+    with metrics.stage('count'):
+        symbol_freq = cnt_symbols(in_file, symbols, buffer_size)
+    symbolCount = sum(symbol_freq.values())
+    metrics.count('count', symbolCount)
+    if symbolCount == 0:
+        with open_outputs(compressed_file, text_file, metrics):
+            pass
+        metrics.finish()
+        return
+
+    with metrics.stage('tables'):
+        model = create_symbol_model(symbol_freq, max_code_length)
+        codes = create_symbol_codes(model)
+    with open_outputs(compressed_file, text_file, metrics) as (bitWriter, outputFile):
+        bitWriter.write_bytes(create_symbol_header(model, symbolCount))
+        if outputFile is not None:
+            codeStrings = {token: format(code, '0%db' % length) if length else '' for token, (code, length) in codes.items()}
+            outputFile.write(create_symbol_text(model))
+            outputFile.write("\n")
+        pattern = TOKEN_PATTERNS[symbols]
+        write_bits = bitWriter.write_bits
+        bits = 0
+        with metrics.stage('pack'), open(in_file) as inputFile:
+            inputFile = metrics.wrap(inputFile)
+            fileString = inputFile.read(buffer_size)
+            while fileString:
+                tokens = fileString if symbols == 'char' else pattern.findall(fileString)
+                if symbols == 'word':
+                    # words that are not symbols are coded one character at a time, as counted
+                    tokens = [char for token in tokens for char in (token if token not in codes else (token,))]
+                if outputFile is not None:
+                    outputFile.write(''.join(codeStrings[token] for token in tokens))
+                for token in tokens:
+                    code, length = codes[token]
+                    write_bits(code, length)
+                    bits += length
+                fileString = inputFile.read(buffer_size)
+        metrics.count('pack', bits=bits)
+    metrics.finish()
+
+def create_symbol_text(model):
+    '''Returns the header line written to the text output file for a symbol file'''
+    return 'symbols ' + ' '.join('%r %d' % pair for pair in zip(model.tokens, model.lengths))
+
+def huffman_decode(encoded_file, decode_file, binary=False, metrics=None):
+    '''Decodes a file written by huffman_encode and writes the decoded text to decode_file
+    Use binary=True for files encoded with binary=True: decode_file then gets the raw bytes
+    If metrics is a huffman_metrics.Metrics object, the time and size of the stages header,
+    tables (building the decoding table, unless cached), read, decode and write are recorded in it'''
+    if metrics is None:
+        metrics = NO_METRICS
+    metrics.begin('decode')
+    chunks = iter_decode(encoded_file, binary=binary, metrics=metrics)
+    with open(decode_file, 'wb' if binary else 'w') as decompressed:
+        decompressed = metrics.wrap(decompressed)
+        with metrics.stage('decode'):
+            for chunk in chunks:
+                decompressed.write(chunk)
+    metrics.finish()
+
+def iter_decode(encoded_file, chunk_size=BUFFER_SIZE, binary=False, metrics=None):
+    '''Returns an iterator over the decoded text of a file written by huffman_encode, in chunks.
+    The encoded bits are read chunk_size bytes at a time and each chunk is decoded and yielded
+    before the next is read, so memory use does not grow with the size of the file.
+    With binary=True the chunks are bytes objects instead of strings.
+    Raises FileNotFoundError straight away (not on first iteration) if encoded_file is missing
+    metrics is a huffman_metrics.Metrics object to record the stages in (see huffman_decode)'''
+    if metrics is None:
+        reader = HuffmanBitReader(encoded_file)
+        metrics = NO_METRICS
+    else:
+        reader = HuffmanBitReader(metrics.wrap(open(encoded_file, 'rb')))
+    chunks = decode_chunks(reader, chunk_size, metrics=metrics)
+    if binary:
+        return (chunk.encode('latin-1') for chunk in chunks)
+    return chunks
+
+def read_header(reader):
+    '''Reads the header of a file written by huffman_encode from reader, in any of its formats.
+    Returns None for an empty file, otherwise (header, charCount, text): the key of the file's
+    tables for decode_tables, the number of encoded characters, and the header line that
+    huffman_encode wrote to its text output file.
+    Raises ValueError if the header is cut short or cannot be parsed'''
+    marker = reader.read_bytes(1)
+    if not marker:
+        return None
     try:
-        fileString = testEmpty(in_file, out_file)
-        if fileString is None:
-            return
-    except FileNotFoundError:
-        raise FileNotFoundError
-    
-    #Everything else
-    compressedFile = out_file.replace('.txt', '_compressed.txt')
-    bitWriter = HuffmanBitWriter(compressedFile)
-    outputFile = open(out_file, 'w')
-
-    frequencies = cnt_freq(in_file)
-    header = create_header(frequencies)
-    rootNode = create_huff_tree(frequencies)
-    codeKey = create_code(rootNode)
-    
-    codeList = []
-    if codeKey is not None:
-        for char in fileString:
-            if char != "" and char is not None and ord(char) is not None:
-                codeList.append(codeKey[ord(char)])
-    code = "".join(codeList)
-
-    outputFile.write(header)
-    outputFile.write("\n")
-    outputFile.write(code)
-    outputFile.close()
-
-    bitWriter.write_str(header + "\n")
-    bitWriter.write_code(code)
-    bitWriter.close()
+        if marker[0] in (CANONICAL_PAIRS, CANONICAL_LENGTHS):
+            lengths, charCount = parse_canonical_header(marker[0], reader)
+            return tuple(lengths), charCount, ' '.join('%d %d' % pair for pair in lengths)
+        if marker[0] == SYMBOL_MARKER:
+            model, symbolCount = parse_symbol_header(reader)
+            return model, symbolCount, create_symbol_text(model)
+        if marker[0] == CONTEXT_MARKER:
+            model, charCount = parse_context_header(reader)
+            return model, charCount, create_context_text(model)
+        if marker[0] == MODEL_MARKER:
+            modelId = MODEL_ID.unpack(reader.read_bytes(MODEL_ID.size))[0]
+            charCount = read_varint(reader)
+            if modelId not in models:
+                raise ValueError("unknown model id %d, register or load the model first" % modelId)
+            return models[modelId][0], charCount, 'model %d' % modelId
+        header = marker.decode('utf-8') + reader.read_str()
+        if not header.endswith('\n') or not any(parse_header(header)):
+            raise ValueError("truncated frequency header")
+        return header, sum(parse_header(header)), header.strip()
+    except (struct.error, IndexError) as error:
+        raise ValueError("truncated or corrupt header") from error
 
-def huffman_decode(encoded_file, decode_file):
+def decode_chunks(reader, chunk_size, headerInfo=None, metrics=NO_METRICS):
+    '''Generator behind iter_decode: reads the header from reader, then yields decoded text.
+    Handles the frequency line header, the binary header of canonical files and model ids.
+    headerInfo is the result of read_header if the caller has already read the header'''
     try:
-        reader = HuffmanBitReader(encoded_file)        
-    except FileNotFoundError:
-        raise FileNotFoundError
-    decompressed = open(decode_file, 'w')    
-    header = reader.read_str()
-    if not header:
-        decompressed.write("")
-        decompressed.close()
-        reader.close()
-        return None
-    freq = parse_header(header)
-    rootNode = create_huff_tree(freq)
-    charCount = 0
-    headerAsList = header.split()
-    for index in range(len(headerAsList)):
-        if index % 2 != 0:
-            charCount += int(headerAsList[index])
-
-    for char in range(charCount):
-        current_node = rootNode  # Start at the root
-        while current_node.left is not None and current_node.right is not None:
-            bit = reader.read_bit()
-            if bit:
-                current_node = current_node.right
-            else:
-                current_node = current_node.left
-        if current_node is not None and current_node.left is None and current_node.right is None:
-            decompressed.write(chr(current_node.char))
+        if headerInfo is None:
+            with metrics.stage('header'):
+                headerInfo = read_header(reader)
+        if headerInfo is None:
+            return
+        header, charCount, text = headerInfo
+        with metrics.stage('tables'):
+            table, onlyChar = decode_tables(header)
 
-    reader.close()
-    decompressed.close()
+        if isinstance(header, SymbolModel):
+            for chunk in decode_symbols(reader, table, charCount, chunk_size, metrics):
+                yield chunk.translate(header.tokens)
+            return
 
+        if table is None:
+            while charCount > 0:
+                chunk = chr(onlyChar) * min(charCount, chunk_size)
+                charCount -= len(chunk)
+                yield chunk
+            return
 
+        state = 0
+        data = reader.read_bytes(chunk_size)
+        while data and charCount > 0:
+            decodedList = []
+            for byte in data:
+                chars, state = table[(state << 8) | byte]
+                decodedList.append(chars)
+            # padding bits in the last byte may decode to extra characters, so cut at charCount
+            chunk = "".join(decodedList)[:charCount]
+            charCount -= len(chunk)
+            metrics.count('decode', len(chunk), 8 * len(data))
+            yield chunk
+            data = reader.read_bytes(chunk_size)
+        if charCount > 0:
+            raise ValueError("truncated file: the encoded data ends %d characters short" % charCount)
+    finally:
+        reader.close()
+
+def decode_symbols(reader, table, symbolCount, chunk_size, metrics=NO_METRICS):
+    '''Generator behind decode_chunks for symbol files: decodes symbolCount symbols from the
+    encoded bytes read from reader, with the decoding table of create_symbol_decode_table, and
+    yields them chunk by chunk as strings of chr(index of symbol)'''
+    if table is None:
+        while symbolCount > 0:
+            chunk = chr(0) * min(symbolCount, chunk_size)
+            symbolCount -= len(chunk)
+            yield chunk
+        return
+    width = len(table).bit_length() - 1
+    shift = 0          # number of bits in window not yet decoded
+    window = 0         # the last bits read, at most width + 8 of them
+    windowMask = (1 << (width + 8)) - 1
+    tableMask = len(table) - 1
+    data = reader.read_bytes(chunk_size)
+    while symbolCount > 0 and data:
+        decodedList = []
+        for byte in data:
+            window = ((window << 8) | byte) & windowMask
+            shift += 8
+            while shift >= width:
+                symbol, length = table[(window >> (shift - width)) & tableMask]
+                decodedList.append(symbol)
+                shift -= length
+        chunk = "".join(decodedList)[:symbolCount]
+        symbolCount -= len(chunk)
+        metrics.count('decode', len(chunk), 8 * len(data))
+        yield chunk
+        data = reader.read_bytes(chunk_size)
+    if symbolCount > 0:
+        # fewer than width bits are left: look them up with zero bits after them, but only
+        # accept codes that end within the bits actually read
+        window <<= width
+        decodedList = []
+        while len(decodedList) < symbolCount:
+            symbol, length = table[(window >> shift) & tableMask]
+            if length > shift:
+                raise ValueError("truncated file: the encoded data ends %d symbols short"
+                                 % (symbolCount - len(decodedList)))
+            decodedList.append(symbol)
+            shift -= length
+        metrics.count('decode', symbolCount)
+        yield "".join(decodedList)
 
+def dump_code(encoded_file, text_file, chunk_size=BUFFER_SIZE):
+    '''Writes the text form of a file written by huffman_encode to text_file: its header line and
+    the codes as '0'/'1' characters, the same as the output file of huffman_encode (so encoding
+    with text_output=False and dumping later gives the same two files as a plain huffman_encode)'''
+    reader = HuffmanBitReader(encoded_file)
+    headerInfo = read_header(reader)
+    with open(text_file, 'w') as textFile:
+        if headerInfo is None:
+            reader.close()
+            return
+        header, charCount, text = headerInfo
+        if isinstance(header, SymbolModel):
+            codeKey = create_code_strings(create_canonical_codes(list(enumerate(header.lengths))))
+            textFile.write(text)
+            textFile.write("\n")
+            for chunk in decode_symbols(reader, decode_tables(header)[0], charCount, chunk_size):
+                textFile.write(chunk.translate(codeKey))
+            reader.close()
+            return
+        if isinstance(header, ContextModel):
+            codeKey = create_code_strings(create_context_codes(header))
+        elif isinstance(header, str):
+            codeKey = encode_tables(tuple(parse_header(header)))[0]
+        else:
+            codeKey = create_code_strings(create_canonical_codes(header))
+        textFile.write(text)
+        textFile.write("\n")
+        previous = 0
+        for chunk in decode_chunks(reader, chunk_size, headerInfo):
+            if isinstance(header, ContextModel):
+                textFile.write(translate_context(chunk, codeKey, previous))
+                previous = ord(chunk[-1]) if chunk else previous
+            else:
+                textFile.write(chunk.translate(codeKey))
 
 def parse_header(header_string):
     frequencies = [0] * 256
     lst = header_string.split()
-    for index in range(len(lst) - 1):
-        if index % 2 == 0:
-            frequencies[int(lst[index])] = int(lst[index + 1])
+    for char, freq in zip(lst[0::2], lst[1::2]):
+        frequencies[int(char)] = int(freq)
     return frequencies
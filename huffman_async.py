@@ -0,0 +1,121 @@
+#
+#   asyncio front end for the Huffman encoder and decoder, for callers running inside an event
+#   loop. The blocking work (file I/O, counting, tree building and coding) runs on an executor
+#   so the loop keeps serving other tasks:
+#
+#       await huffman_encode_async('big.txt', 'big_out.txt', text_output=False)
+#       async for chunk in iter_decode_async('big_out_compressed.txt'):
+#           ...
+#
+#   The default executor is the loop's thread pool. CPU-bound Python code in a thread still
+#   holds the GIL, but the interpreter hands it back every few milliseconds (see
+#   sys.getswitchinterval), so the loop is never stalled for a whole file. Passing a
+#   ProcessPoolExecutor to huffman_encode_async/huffman_decode_async takes the coding off this
+#   process entirely. iter_decode_async and the stream wrappers keep state in this process, so
+#   they need a thread pool (or None).
+#
+
+import asyncio
+import functools
+import io
+from huffman import BUFFER_SIZE, decode_chunks, huffman_encode
+from huffman_bit_reader import HuffmanBitReader
+from huffman_bit_writer import HuffmanBitWriter
+
+
+async def run_blocking(executor, function, *args, **kwargs):
+    '''Runs function(*args, **kwargs) on executor (None: the loop's default thread pool) and
+    returns its result without blocking the running event loop'''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+async def huffman_encode_async(in_file, out_file, executor=None, **options):
+    '''huffman_encode(in_file, out_file, **options) run on executor, see huffman_encode for the
+    options. Use text_output=False unless the '0'/'1' text file is really wanted'''
+    await run_blocking(executor, huffman_encode, in_file, out_file, **options)
+
+
+async def iter_decode_async(encoded_file, chunk_size=BUFFER_SIZE, binary=False, executor=None):
+    '''Async generator version of iter_decode: each chunk is read and decoded on executor, and
+    control returns to the event loop between chunks'''
+    reader = await run_blocking(executor, HuffmanBitReader, encoded_file)
+    chunks = decode_chunks(reader, chunk_size)
+    try:
+        while True:
+            chunk = await run_blocking(executor, next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk.encode('latin-1') if binary else chunk
+    finally:
+        await run_blocking(executor, chunks.close)
+
+
+async def huffman_decode_async(encoded_file, decode_file, binary=False, executor=None):
+    '''Async version of huffman_decode: decodes with iter_decode_async and writes each chunk to
+    decode_file on executor'''
+    decompressed = await run_blocking(executor, open, decode_file, 'wb' if binary else 'w')
+    try:
+        async for chunk in iter_decode_async(encoded_file, binary=binary, executor=executor):
+            await run_blocking(executor, decompressed.write, chunk)
+    finally:
+        await run_blocking(executor, decompressed.close)
+
+
+# --------------------------------------------------------------------
+# AsyncHuffmanBitReader is an AsyncHuffmanBitReader(string)
+# HuffmanBitReader whose file reads run on an executor. Only the bulk methods are async:
+# read the encoded bytes with read_bytes and decode them in memory
+class AsyncHuffmanBitReader:
+    # side effect: open a file with file name 'fname' for reading in binary mode
+    # (fname may also be a binary file object that is already open, e.g. io.BytesIO)
+    def __init__(self, fname, executor=None):
+        self.reader = HuffmanBitReader(fname)
+        self.executor = executor
+
+    # side effect: closes opened file
+    async def close(self):
+        await run_blocking(self.executor, self.reader.close)
+
+    # Use this method to read the header from the compressed file.
+    async def read_str(self):
+        return await run_blocking(self.executor, self.reader.read_str)
+
+    # Use this method to read the encoded bits in bulk, see HuffmanBitReader.read_bytes
+    async def read_bytes(self, size=-1):
+        return await run_blocking(self.executor, self.reader.read_bytes, size)
+
+
+# --------------------------------------------------------------------
+# AsyncHuffmanBitWriter is an AsyncHuffmanBitWriter(string)
+# HuffmanBitWriter that packs bits in memory and writes them to the file on an executor.
+# Like asyncio.StreamWriter the write methods are plain calls and 'await drain()' hands the
+# bytes collected so far to the file; call it every so often to keep memory use bounded
+class AsyncHuffmanBitWriter:
+    # side effect: open a file with file name 'fname' for writing in binary mode
+    # (fname may also be a binary file object that is already open, e.g. io.BytesIO)
+    def __init__(self, fname, executor=None):
+        self.file = fname if hasattr(fname, 'write') else open(fname, 'wb')
+        self.executor = executor
+        self.pending = io.BytesIO()   # whole bytes packed by writer, not yet in the file
+        self.writer = HuffmanBitWriter(self.pending)
+        self.write_str = self.writer.write_str
+        self.write_bytes = self.writer.write_bytes
+        self.write_code = self.writer.write_code
+        self.write_bits = self.writer.write_bits
+
+    # Use this method to write the whole bytes collected so far to the file
+    async def drain(self):
+        self.pending.write(self.writer.buffer)
+        self.writer.buffer.clear()
+        data = self.pending.getvalue()
+        self.pending.seek(0)
+        self.pending.truncate()
+        if data:
+            await run_blocking(self.executor, self.file.write, data)
+
+    # Use this method to close the compressed file (the last byte is padded with 0s)
+    async def close(self):
+        self.writer.flush()
+        await self.drain()
+        await run_blocking(self.executor, self.file.close)
@@ -0,0 +1,97 @@
+#
+#   Batch mode: compress or decompress many files in one call. The files are spread over a
+#   pool of worker processes (or threads) that is started once for the whole batch, and the
+#   result for every file is a FileStats record instead of an exception
+#
+
+import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import huffman
+from huffman import compressed_name, encode_file, huffman_decode, register_model
+from huffman_blocks import map_bounded
+
+FileStats = collections.namedtuple('FileStats', ['in_file', 'out_file', 'bytes_in', 'bytes_out',
+                                                 'ratio', 'seconds', 'error'])
+FileStats.__doc__ = '''Result of one file of a batch: sizes in bytes, ratio (bytes_out / bytes_in,
+1.0 for an empty file), wall-clock seconds, and error (None, or the message if the file failed)'''
+
+
+def default_name(path, suffix, new_suffix):
+    '''Returns path with suffix replaced by new_suffix (new_suffix is appended if path does not
+    end with suffix)'''
+    if path.endswith(suffix):
+        return path[:-len(suffix)] + new_suffix
+    return path + new_suffix
+
+
+def run_job(function, in_file, out_file, *args, **kwargs):
+    '''Runs function(in_file, out_file, *args, **kwargs) and returns its FileStats'''
+    start = time.perf_counter()
+    try:
+        function(in_file, out_file, *args, **kwargs)
+        bytesIn = os.path.getsize(in_file)
+        bytesOut = os.path.getsize(out_file)
+        error = None
+    except (OSError, ValueError) as exception:
+        bytesIn = bytesOut = 0
+        error = '%s: %s' % (type(exception).__name__, exception)
+    ratio = bytesOut / bytesIn if bytesIn else 1.0
+    return FileStats(in_file, out_file, bytesIn, bytesOut, ratio, time.perf_counter() - start, error)
+
+
+def register_models(modelFreqs):
+    '''Registers the model frequency lists modelFreqs in this process. Worker processes started
+    with spawn or forkserver do not inherit the models registered in the parent, so every job
+    carries the ones it may need'''
+    for char_freq in modelFreqs:
+        register_model(char_freq)
+
+
+def compress_job(job):
+    '''Compresses one file of compress_files; job is (in_file, out_file, text_output, options,
+    modelFreqs)'''
+    in_file, out_file, text_output, options, modelFreqs = job
+    register_models(modelFreqs)
+    return run_job(encode_file, in_file, compressed_name(out_file), out_file if text_output else None,
+                   **options)
+
+
+def decompress_job(job):
+    '''Decompresses one file of decompress_files; job is (encoded_file, decode_file, binary,
+    modelFreqs)'''
+    encoded_file, decode_file, binary, modelFreqs = job
+    register_models(modelFreqs)
+    return run_job(huffman_decode, encoded_file, decode_file, binary)
+
+
+def compress_files(paths, workers=None, threads=False, text_output=False, **options):
+    '''Compresses many files on up to workers processes (default: one per CPU), or threads if
+    threads is True. paths is a list or iterator of input file names, or of (in_file, out_file)
+    pairs; a plain in_file has out_file in_file with .txt replaced by _out.txt. The compressed
+    file is out_file with _compressed added before its extension (see compressed_name), and it
+    is the only file written unless text_output is True. options are passed on to encode_file
+    (buffer_size, canonical, max_code_length, binary, model); a model must be registered in
+    this process, and is sent to the workers with every job.
+    Returns a list with the FileStats of every file, in the order of paths'''
+    model = options.get('model')
+    modelFreqs = (huffman.models[model][1],) if model in huffman.models else ()
+    jobs = ((path, default_name(path, '.txt', '_out.txt'), text_output, options, modelFreqs)
+            if isinstance(path, str) else (path[0], path[1], text_output, options, modelFreqs)
+            for path in paths)
+    executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    return list(map_bounded(compress_job, jobs, workers, executor_class))
+
+
+def decompress_files(paths, workers=None, threads=False, binary=False):
+    '''Decompresses many files like compress_files. paths is a list or iterator of compressed file
+    names, or of (encoded_file, decode_file) pairs; a plain encoded_file is decoded to its name
+    with _compressed.txt replaced by _decoded.txt. The models registered in this process are sent
+    to the workers with every job, so files encoded with a model can be decoded.
+    Returns a list of FileStats'''
+    modelFreqs = tuple(char_freq for header, char_freq in huffman.models.values())
+    jobs = ((path, default_name(path, '_compressed.txt', '_decoded.txt'), binary, modelFreqs)
+            if isinstance(path, str) else (path[0], path[1], binary, modelFreqs) for path in paths)
+    executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    return list(map_bounded(decompress_job, jobs, workers, executor_class))
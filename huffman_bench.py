@@ -0,0 +1,687 @@
+#
+#   Throughput benchmarks for the Huffman encoder and decoder
+#   Run with: python huffman_bench.py [benchmark name] [input file] [benchmark options]
+#   For results that can be compared between commits, use the JSON harness:
+#       python huffman_bench.py suite file_WAP.txt before.json
+#       python huffman_bench.py compare before.json after.json
+#
+
+import heapq
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from huffman import *
+from huffman_blocks import compress_blocks, decompress_blocks
+from huffman_stream import SEGMENT_SIZE, adaptive_decode, adaptive_encode
+from huffman_cli import verify
+from huffman_bit_reader import HuffmanMappedBitReader
+from huffman_bit_writer import HuffmanBufferBitWriter
+from ordered_list import OrderedList
+
+
+def tree_walk_decode(encoded_file, decode_file):
+    '''Reference decoder that walks the Huffman tree one bit at a time (the original huffman_decode)'''
+    reader = HuffmanBitReader(encoded_file)
+    decompressed = open(decode_file, 'w')
+    header = reader.read_str()
+    if header:
+        rootNode = create_huff_tree(parse_header(header))
+        charCount = sum(parse_header(header))
+        for char in range(charCount):
+            current_node = rootNode
+            while current_node.left is not None and current_node.right is not None:
+                if reader.read_bit():
+                    current_node = current_node.right
+                else:
+                    current_node = current_node.left
+            decompressed.write(chr(current_node.char))
+    reader.close()
+    decompressed.close()
+
+
+class DictHuffmanNode:
+    '''HuffmanNode as it was before __slots__, with a __dict__ per node'''
+    def __init__(self, char, freq):
+        self.char = char
+        self.freq = freq
+        self.left = None
+        self.right = None
+
+
+def node_huff_tree(char_freq, node_class=HuffmanNode):
+    '''create_huff_tree building its tree out of node_class objects'''
+    nodes = [(freq, char, node_class(char, freq)) for char, freq in enumerate(char_freq) if freq > 0]
+    heapq.heapify(nodes)
+    while len(nodes) > 1:
+        leftChild = heapq.heappop(nodes)[2]
+        rightChild = heapq.heappop(nodes)[2]
+        newInternalNode = node_class(min(leftChild.char, rightChild.char), leftChild.freq + rightChild.freq)
+        newInternalNode.left = leftChild
+        newInternalNode.right = rightChild
+        heapq.heappush(nodes, (newInternalNode.freq, newInternalNode.char, newInternalNode))
+    return heapq.heappop(nodes)[2]
+
+
+def walk_nodes(rootNode, bits):
+    '''Decodes a string of '0'/'1' bits by walking a tree of nodes one bit at a time'''
+    decoded = []
+    node = rootNode
+    for bit in bits:
+        node = node.right if bit == '1' else node.left
+        if node.left is None:
+            decoded.append(node.char)
+            node = rootNode
+    return decoded
+
+
+def walk_arrays(tree, bits):
+    '''walk_nodes for a tree of create_huff_arrays'''
+    left, right, root = tree
+    decoded = []
+    node = root
+    for bit in bits:
+        node = right[node] if bit == '1' else left[node]
+        if node < 0:
+            decoded.append(~node)
+            node = root
+    return decoded
+
+
+def traced_size(function, *args):
+    '''Returns the bytes of Python heap held by the result of function(*args)'''
+    tracemalloc.start()
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def ordered_list_huff_tree(char_freq):
+    '''Reference tree builder that keeps the nodes in an OrderedList (the original create_huff_tree)'''
+    nodes = OrderedList()
+    for char, freq in enumerate(char_freq):
+        if freq > 0:
+            nodes.add(HuffmanNode(char, freq))
+    while nodes.size() > 1:
+        leftChild = nodes.pop(0)
+        rightChild = nodes.pop(0)
+        newInternalNode = HuffmanNode(min(leftChild.char, rightChild.char), leftChild.freq + rightChild.freq)
+        newInternalNode.left = leftChild
+        newInternalNode.right = rightChild
+        nodes.add(newInternalNode)
+    return nodes.pop(0)
+
+
+def same_tree(first, second):
+    '''Returns True if both Huffman trees have the same shape, characters and frequencies'''
+    pairs = [(first, second)]
+    while pairs:
+        first, second = pairs.pop()
+        if first is None or second is None:
+            if first is not second:
+                return False
+        elif first.char != second.char or first.freq != second.freq:
+            return False
+        else:
+            pairs.append((first.left, second.left))
+            pairs.append((first.right, second.right))
+    return True
+
+
+def time_call(function, *args):
+    '''Returns the wall-clock seconds taken by function(*args)'''
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_decode(in_file):
+    '''Compares decode throughput (MB/s of decoded output) of the tree walk and the table decoder'''
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        encoded_file = compressed_name(out_file)
+        huffman_encode(in_file, out_file)
+        walk_file = os.path.join(tmp, 'walk_decoded.txt')
+        table_file = os.path.join(tmp, 'table_decoded.txt')
+        walkSeconds = time_call(tree_walk_decode, encoded_file, walk_file)
+        tableSeconds = time_call(huffman_decode, encoded_file, table_file)
+        with open(walk_file, 'rb') as walk, open(table_file, 'rb') as table:
+            identical = walk.read() == table.read()
+        megabytes = os.path.getsize(table_file) / 1e6
+    print('decode %s (%.2f MB)' % (in_file, megabytes))
+    print('  tree walk: %8.2f MB/s' % (megabytes / walkSeconds))
+    print('  table:     %8.2f MB/s  (%.1fx, identical output: %s)'
+          % (megabytes / tableSeconds, walkSeconds / tableSeconds, identical))
+
+
+def bench_tree_build(in_file=None):
+    '''Times create_huff_tree on synthetic alphabets of 2 to 65536 symbols. The OrderedList
+    builder is quadratic and its recursive size() hits the recursion limit, so it is only
+    timed (and checked for an identical tree) on the smaller alphabets'''
+    generator = random.Random(0)
+    print('create_huff_tree (synthetic alphabets)')
+    print('  %8s %12s %14s' % ('symbols', 'heap (ms)', 'ordered (ms)'))
+    for power in range(1, 17):
+        symbols = 1 << power
+        char_freq = [generator.randint(1, 1000) for char in range(symbols)]
+        heapSeconds = time_call(create_huff_tree, char_freq)
+        ordered = ''
+        if symbols <= 512:
+            orderedSeconds = time_call(ordered_list_huff_tree, char_freq)
+            same = same_tree(create_huff_tree(char_freq), ordered_list_huff_tree(char_freq))
+            ordered = '%8.2f %s' % (orderedSeconds * 1000, 'same tree' if same else 'DIFFERENT TREE')
+        print('  %8d %12.2f %14s' % (symbols, heapSeconds * 1000, ordered))
+
+
+def bench_encode_memory(in_file):
+    '''Reports wall-clock time and peak Python heap use of huffman_encode for several buffer
+    sizes; a buffer size of -1 reads the whole input at once like the original encoder'''
+    megabytes = os.path.getsize(in_file) / 1e6
+    print('encode %s (%.2f MB)' % (in_file, megabytes))
+    print('  %12s %10s %14s' % ('buffer', 'MB/s', 'peak heap MB'))
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        for buffer_size in (1 << 12, 1 << 16, 1 << 20, -1):
+            seconds = time_call(huffman_encode, in_file, out_file, buffer_size)
+            tracemalloc.start()
+            huffman_encode(in_file, out_file, buffer_size)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            label = 'whole file' if buffer_size == -1 else str(buffer_size)
+            print('  %12s %10.2f %14.2f' % (label, megabytes / seconds, peak / 1e6))
+
+
+def bench_blocks(in_file, megabytes='64'):
+    '''Reports block mode compress and decompress throughput with 1, 2, 4 and 8 worker
+    processes, on in_file replicated to about the given number of megabytes'''
+    with open(in_file, 'rb') as file:
+        data = file.read()
+    with tempfile.TemporaryDirectory() as tmp:
+        big_file = os.path.join(tmp, 'replicated.txt')
+        with open(big_file, 'wb') as file:
+            for copy in range(max(1, int(float(megabytes) * 1e6) // len(data))):
+                file.write(data)
+        size = os.path.getsize(big_file) / 1e6
+        container = os.path.join(tmp, 'replicated.hufb')
+        decoded = os.path.join(tmp, 'replicated_decoded.txt')
+        print('block mode %s x%d (%.0f MB, %d CPUs)' % (in_file, size * 1e6 // len(data), size, os.cpu_count()))
+        print('  %8s %16s %18s' % ('workers', 'compress MB/s', 'decompress MB/s'))
+        for workers in (1, 2, 4, 8):
+            compressSeconds = time_call(compress_blocks, big_file, container, 1 << 20, workers)
+            decompressSeconds = time_call(decompress_blocks, container, decoded, workers)
+            print('  %8d %16.2f %18.2f' % (workers, size / compressSeconds, size / decompressSeconds))
+
+
+def bench_length_limit(in_file, *corpus):
+    '''Reports the size of the encoded bits with code lengths limited to 8-15 bits, relative to
+    unconstrained Huffman codes, for in_file and any further corpus files'''
+    print('length-limited codes (encoded bits relative to unconstrained Huffman codes)')
+    limits = range(8, 16)
+    print('  %-28s %8s ' % ('file', 'longest') + ' '.join('%7d' % limit for limit in limits))
+    for name in (in_file,) + corpus:
+        char_freq = cnt_freq(name)
+        lengths = create_code_lengths(char_freq)
+        best = sum(char_freq[char] * length for char, length in lengths)
+        costs = []
+        for limit in limits:
+            try:
+                limited = create_code_lengths(char_freq, limit)
+                bits = sum(char_freq[char] * length for char, length in limited)
+                costs.append('%+6.2f%%' % (100.0 * (bits - best) / best))
+            except ValueError:
+                costs.append('%7s' % '-')
+        longest = max(length for char, length in lengths)
+        print('  %-28s %8d ' % (name, longest) + ' '.join(costs))
+
+
+def bench_count(in_file, megabytes='256'):
+    '''Reports frequency counting throughput: count_bytes on in_file replicated in memory to about
+    the given number of megabytes, and cnt_freq on in_file in text and in binary mode'''
+    with open(in_file, 'rb') as file:
+        data = file.read()
+    data *= max(1, int(float(megabytes) * 1e6) // len(data))
+    backend = 'numpy.bincount' if numpy is not None else 'Python loop'
+    print('frequency counting (%s)' % backend)
+    seconds = time_call(count_bytes, data)
+    print('  count_bytes         %8.3f GB/s  (%.0f MB in memory)' % (len(data) / seconds / 1e9, len(data) / 1e6))
+    size = os.path.getsize(in_file)
+    for binary in (False, True):
+        seconds = time_call(cnt_freq, in_file, BUFFER_SIZE, binary)
+        print('  cnt_freq %-10s %8.3f GB/s' % ('binary' if binary else 'text', size / seconds / 1e9))
+
+
+def read_all_bits(reader_class, encoded_file, bits):
+    '''Reads the header and then the given number of bits with reader_class.read_bit'''
+    reader = reader_class(encoded_file)
+    reader.read_str()
+    read_bit = reader.read_bit
+    for bit in range(bits):
+        read_bit()
+    reader.close()
+
+
+def write_all_bits(writer_class, out_file, codes):
+    '''Writes every (code, length) pair in codes with writer_class.write_bits'''
+    writer = writer_class(out_file)
+    write_bits = writer.write_bits
+    for code, length in codes:
+        write_bits(code, length)
+    writer.close()
+
+
+def bench_bit_io(in_file):
+    '''Reports bits/second of read_bit and write_bits for the file-backed reader and writer
+    and for the memory-mapped reader and bytearray-backed writer, on in_file's codes'''
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        encoded_file = compressed_name(out_file)
+        huffman_encode(in_file, out_file)
+        with open(in_file) as file:
+            fileString = file.read()
+        codeBits = create_code_bits(create_code(create_huff_tree(cnt_freq(in_file))))
+        codes = [codeBits[ord(char)] for char in fileString]
+        bits = sum(length for code, length in codes)
+        print('bit I/O on %s codes (%.1f Mbit)' % (in_file, bits / 1e6))
+        for name, reader_class in (('HuffmanBitReader', HuffmanBitReader),
+                                   ('HuffmanMappedBitReader', HuffmanMappedBitReader)):
+            seconds = time_call(read_all_bits, reader_class, encoded_file, bits)
+            print('  %-24s read_bit   %8.2f Mbit/s' % (name, bits / seconds / 1e6))
+        for name, writer_class in (('HuffmanBitWriter', HuffmanBitWriter),
+                                   ('HuffmanBufferBitWriter', HuffmanBufferBitWriter)):
+            seconds = time_call(write_all_bits, writer_class, os.path.join(tmp, name), codes)
+            print('  %-24s write_bits %8.2f Mbit/s' % (name, bits / seconds / 1e6))
+
+
+def bench_table_cache(in_file, files='200'):
+    '''Times encoding and decoding many small files that share one character distribution,
+    with the table caches cleared before every file and with the caches kept'''
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        decoded = os.path.join(tmp, 'bench_decoded.txt')
+        def round_trips(clear):
+            for file in range(int(files)):
+                if clear:
+                    clear_table_caches()
+                huffman_encode(in_file, out_file)
+                huffman_decode(compressed_name(out_file), decoded)
+        print('table cache: %s files like %s' % (files, in_file))
+        clearedSeconds = time_call(round_trips, True)
+        clear_table_caches()
+        cachedSeconds = time_call(round_trips, False)
+        info = table_cache_info()
+        print('  cleared: %8.2f ms/file' % (clearedSeconds * 1000 / int(files)))
+        print('  cached:  %8.2f ms/file  (encode %d hits %d misses, decode %d hits %d misses)'
+              % (cachedSeconds * 1000 / int(files), info['encode'].hits, info['encode'].misses,
+                 info['decode'].hits, info['decode'].misses))
+
+
+def bench_model(in_file, *small_files):
+    '''Trains a shared model on in_file and compares compressed size and round-trip time of
+    small files encoded with their own header and with the model'''
+    small_files = small_files or ('file1.txt', 'file2.txt', 'multiline.txt', 'declaration.txt')
+    modelId = register_model(train_model([in_file]))
+    print('shared model trained on %s' % in_file)
+    print('  %-18s %8s %14s %14s %12s %12s' % ('file', 'bytes', 'header bytes', 'model bytes',
+                                               'header ms', 'model ms'))
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        compressed = compressed_name(out_file)
+        decoded = os.path.join(tmp, 'bench_decoded.txt')
+        for name in small_files:
+            results = []
+            for model in (None, modelId):
+                clear_table_caches()
+                huffman_encode(name, out_file, model=model)
+                huffman_decode(compressed, decoded)
+                start = time.perf_counter()
+                for repeat in range(20):
+                    huffman_encode(name, out_file, model=model)
+                    huffman_decode(compressed, decoded)
+                results.append((os.path.getsize(compressed), (time.perf_counter() - start) * 1000 / 20))
+            print('  %-18s %8d %14d %14d %12.2f %12.2f' % (name, os.path.getsize(name), results[0][0],
+                                                         results[1][0], results[0][1], results[1][1]))
+
+
+def bench_text_output(in_file):
+    '''Compares wall-clock time and bytes written by huffman_encode with and without the '0'/'1'
+    text output file, and the time dump_code takes to produce that file afterwards'''
+    print('encode %s (%.2f MB)' % (in_file, os.path.getsize(in_file) / 1e6))
+    print('  %-14s %10s %16s' % ('text output', 'seconds', 'bytes written'))
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        compressed = compressed_name(out_file)
+        for text_output in (True, False):
+            if os.path.exists(out_file):
+                os.remove(out_file)
+            seconds = time_call(lambda: huffman_encode(in_file, out_file, text_output=text_output))
+            written = os.path.getsize(compressed)
+            if text_output:
+                written += os.path.getsize(out_file)
+            print('  %-14s %10.3f %16d' % (text_output, seconds, written))
+        seconds = time_call(dump_code, compressed, out_file)
+        print('  dump_code afterwards: %.3f seconds, %d bytes' % (seconds, os.path.getsize(out_file)))
+
+
+def bench_adaptive(in_file):
+    '''Compares the size and throughput of the one-pass adaptive stream with the two-pass
+    canonical encoder, for reads of a whole segment and of 256 bytes (a line-at-a-time stream)'''
+    megabytes = os.path.getsize(in_file) / 1e6
+    print('adaptive stream %s (%.2f MB)' % (in_file, megabytes))
+    print('  %-22s %12s %12s %12s' % ('mode', 'bytes', 'encode MB/s', 'decode MB/s'))
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        compressed = compressed_name(out_file)
+        decoded = os.path.join(tmp, 'bench_decoded.txt')
+        encode = time_call(lambda: huffman_encode(in_file, out_file, canonical=True, text_output=False))
+        decode = time_call(huffman_decode, compressed, decoded)
+        print('  %-22s %12d %12.2f %12.2f' % ('two-pass canonical', os.path.getsize(compressed),
+                                              megabytes / encode, megabytes / decode))
+        for segment_size in (SEGMENT_SIZE, 256):
+            encode = time_call(adaptive_encode, in_file, compressed, segment_size)
+            decode = time_call(adaptive_decode, compressed, decoded)
+            print('  %-22s %12d %12.2f %12.2f' % ('adaptive, %d B reads' % segment_size,
+                                                  os.path.getsize(compressed), megabytes / encode,
+                                                  megabytes / decode))
+
+
+def bench_tree_memory(in_file):
+    '''Compares the three tree representations: HuffmanNode objects with a __dict__ (as they
+    were), with __slots__, and the flat arrays of create_huff_arrays. Reports the memory held
+    per tree, the time to build the byte decoding table and a one-bit-at-a-time decode
+    (best of several runs)'''
+    generator = random.Random(0)
+    builders = (('dict nodes', lambda char_freq: node_huff_tree(char_freq, DictHuffmanNode)),
+                ('slot nodes', create_huff_tree),
+                ('arrays', create_huff_arrays))
+    print('tree memory (bytes per tree)')
+    print('  %8s %12s %12s %12s' % ('symbols', 'dict nodes', 'slot nodes', 'arrays'))
+    for symbols in (256, 4096, 65536):
+        char_freq = [generator.randint(1, 1000) for char in range(symbols)]
+        print('  %8d %12d %12d %12d' % ((symbols,) + tuple(traced_size(builder, char_freq)
+                                                           for name, builder in builders)))
+
+    char_freq = cnt_freq(in_file)
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        huffman_encode(in_file, out_file, text_output=False)
+        with open(compressed_name(out_file), 'rb') as file:
+            file.readline()
+            bits = ''.join(format(byte, '08b') for byte in file.read(1 << 17))
+    print('decode %s: byte table build and %d bits walked one at a time' % (in_file, len(bits)))
+    print('  %-12s %12s %12s' % ('tree', 'table (ms)', 'walk (MB/s)'))
+    results = []
+    for name, builder in builders:
+        tree = builder(char_freq)
+        if name == 'arrays':
+            create_table, walk = create_array_decode_table, walk_arrays
+        else:
+            create_table, walk = create_decode_table, walk_nodes
+        tableSeconds = min(time_call(create_table, tree) for repeat in range(5))
+        walkSeconds = min(time_call(walk, tree, bits) for repeat in range(3))
+        results.append(walk(tree, bits))
+        print('  %-12s %12.2f %12.2f' % (name, tableSeconds * 1000, len(results[-1]) / 1e6 / walkSeconds))
+    print('  identical output: %s' % (results[0] == results[1] == results[2]))
+
+
+def bench_context(in_file, *corpus):
+    '''Compares the order-1 context mode with the canonical order-0 encoder: compressed size and
+    encode and decode throughput (MB/s of original data; decode with a cold table cache)'''
+    corpus = corpus or (in_file, 'declaration.txt')
+    print('context mode vs order-0')
+    print('  %-18s %-9s %10s %8s %11s %11s' % ('file', 'mode', 'bytes', 'ratio', 'encode MB/s', 'decode MB/s'))
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        compressed = compressed_name(out_file)
+        decoded = os.path.join(tmp, 'bench_decoded.txt')
+        for name in corpus:
+            megabytes = os.path.getsize(name) / 1e6
+            for mode, options in (('order-0', {'canonical': True}), ('context', {'context': True})):
+                clear_table_caches()
+                encode = time_call(lambda: huffman_encode(name, out_file, text_output=False, **options))
+                clear_table_caches()
+                decode = time_call(huffman_decode, compressed, decoded)
+                size = os.path.getsize(compressed)
+                print('  %-18s %-9s %10d %8.3f %11.2f %11.2f' % (name, mode, size, size / 1e6 / megabytes,
+                                                                  megabytes / encode, megabytes / decode))
+
+
+def bench_symbols(in_file, *corpus):
+    '''Compares symbol files over characters and over words with the canonical order-0 encoder:
+    compressed size, bits per decoded symbol and throughput (MB/s of original data)'''
+    corpus = corpus or (in_file, 'declaration.txt')
+    print('symbol alphabets vs order-0')
+    print('  %-18s %-9s %10s %8s %9s %11s %11s' % ('file', 'mode', 'bytes', 'ratio', 'bits/sym',
+                                                   'encode MB/s', 'decode MB/s'))
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, 'bench_out.txt')
+        compressed = compressed_name(out_file)
+        decoded = os.path.join(tmp, 'bench_decoded.txt')
+        for name in corpus:
+            megabytes = os.path.getsize(name) / 1e6
+            for mode, options in (('order-0', {'canonical': True}), ('char', {'symbols': 'char'}),
+                                  ('word', {'symbols': 'word'})):
+                encode = time_call(lambda: huffman_encode(name, out_file, text_output=False, **options))
+                clear_table_caches()
+                decode = time_call(huffman_decode, compressed, decoded)
+                symbolCount = sum(cnt_symbols(name, options.get('symbols', 'char')).values())
+                size = os.path.getsize(compressed)
+                print('  %-18s %-9s %10d %8.3f %9.2f %11.2f %11.2f' % (name, mode, size, size / 1e6 / megabytes,
+                                                                        8 * size / symbolCount, megabytes / encode,
+                                                                        megabytes / decode))
+
+
+def bench_vectorize(in_file, repeats='3'):
+    '''Compares the encode throughput (MB/s of input, best of repeats) of the NumPy bulk packer
+    (pack_codes) with the per-character write_bits loop, with text_output=False, and checks that
+    both write the same compressed file'''
+    if numpy is None:
+        print('NumPy is not installed, only the write_bits loop is available')
+        return
+    megabytes = os.path.getsize(in_file) / 1e6
+    print('encode %s (%.2f MB), best of %s' % (in_file, megabytes, repeats))
+    print('  %-10s %-10s %10s %10s' % ('mode', 'packer', 'seconds', 'MB/s'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, options in (('order-0', {}), ('canonical', {'canonical': True}), ('context', {'context': True})):
+            outputs = []
+            for vectorize in (False, True):
+                out_file = os.path.join(tmp, 'bench_%s_out.txt' % vectorize)
+                seconds = best_time(int(repeats), lambda: huffman_encode(in_file, out_file, text_output=False,
+                                                                         vectorize=vectorize, **options))
+                with open(compressed_name(out_file), 'rb') as file:
+                    outputs.append(file.read())
+                print('  %-10s %-10s %10.3f %10.2f' % (mode, 'pack_codes' if vectorize else 'write_bits',
+                                                        seconds, megabytes / seconds))
+            print('  %-10s identical output: %s' % ('', outputs[0] == outputs[1]))
+
+
+def bench_verify(in_file, megabytes='64'):
+    '''Compares checking a compressed file with huffman_cli.verify to decompressing it, on in_file
+    replicated to about the given number of megabytes: as a block container and an adaptive
+    stream (checked by CRC, without decoding), and in the canonical huffman_encode format (which
+    verify has to decode). Throughput is MB/s of compressed file'''
+    with open(in_file, 'rb') as file:
+        data = file.read()
+    with tempfile.TemporaryDirectory() as tmp:
+        big_file = os.path.join(tmp, 'replicated.txt')
+        with open(big_file, 'wb') as file:
+            for copy in range(max(1, int(float(megabytes) * 1e6) // len(data))):
+                file.write(data)
+        decoded = os.path.join(tmp, 'replicated_decoded.txt')
+        container = os.path.join(tmp, 'replicated.hufb')
+        stream = os.path.join(tmp, 'replicated.hufs')
+        single = os.path.join(tmp, 'replicated_out_compressed.txt')
+        compress_blocks(big_file, container)
+        adaptive_encode(big_file, stream)
+        huffman_encode(big_file, os.path.join(tmp, 'replicated_out.txt'), canonical=True, binary=True,
+                       text_output=False)
+        print('verify vs decompress, %s replicated to %.0f MB' % (in_file, os.path.getsize(big_file) / 1e6))
+        print('  %-10s %10s %12s %16s' % ('format', 'MB', 'verify MB/s', 'decompress MB/s'))
+        for name, path, decompress in (('blocks', container, lambda: decompress_blocks(container, decoded, 1)),
+                                       ('stream', stream, lambda: adaptive_decode(stream, decoded)),
+                                       ('canonical', single, lambda: huffman_decode(single, decoded, True))):
+            size = os.path.getsize(path) / 1e6
+            verifySeconds = time_call(verify, path)
+            decompressSeconds = time_call(decompress)
+            print('  %-10s %10.1f %12.1f %16.1f' % (name, size, size / verifySeconds, size / decompressSeconds))
+
+
+def best_time(repeats, function, *args):
+    '''Returns the best seconds per call of function(*args) over repeats runs; functions that
+    take less than 0.2 seconds are called several times per run (see timeit.Timer.autorange)'''
+    timer = timeit.Timer(lambda: function(*args))
+    number = timer.autorange()[0]
+    return min(timer.repeat(repeats, number)) / number
+
+
+def generate_input(path, size, symbols, skew, seed=0):
+    '''Writes size random bytes to path, drawn from byte values 0 to symbols - 1 with Zipf-like
+    weights 1 / (rank + 1) ** skew (skew 0 is uniform). The same arguments give the same file'''
+    generator = random.Random(seed)
+    weights = [1 / (rank + 1) ** skew for rank in range(symbols)]
+    with open(path, 'wb') as file:
+        file.write(bytes(generator.choices(range(symbols), weights, k=size)))
+
+
+def entropy(char_freq):
+    '''Returns the order-0 entropy in bits per character of a frequency list'''
+    total = sum(char_freq)
+    return -sum(freq / total * math.log2(freq / total) for freq in char_freq if freq)
+
+
+def measure_input(in_file, binary, repeats, tmp):
+    '''Times every layer of the encoder and decoder on in_file and returns the results as a dict'''
+    out_file = os.path.join(tmp, 'suite_out.txt')
+    encoded_file = compressed_name(out_file)
+    decoded_file = os.path.join(tmp, 'suite_decoded.txt')
+    char_freq = cnt_freq(in_file, binary=binary)
+    rootNode = create_huff_tree(char_freq)
+    codeBits = create_code_bits(create_code(rootNode))
+    with open(in_file, 'rb' if binary else 'r') as file:
+        data = file.read()
+    codes = [codeBits[byte] for byte in data] if binary else [codeBits[ord(char)] for char in data]
+    bits = sum(length for code, length in codes)
+    readBits = min(bits, 1 << 20)
+    huffman_encode(in_file, out_file, binary=binary, text_output=False)
+    seconds = {
+        'cnt_freq': best_time(repeats, cnt_freq, in_file, BUFFER_SIZE, binary),
+        'create_huff_tree': best_time(repeats, create_huff_tree, char_freq),
+        'create_code': best_time(repeats, create_code, rootNode),
+        'huffman_encode': best_time(repeats, lambda: huffman_encode(in_file, out_file, binary=binary,
+                                                                    text_output=False)),
+        'huffman_decode': best_time(repeats, huffman_decode, encoded_file, decoded_file, binary),
+        'read_bit': best_time(repeats, read_all_bits, HuffmanBitReader, encoded_file, readBits),
+        'write_bits': best_time(repeats, write_all_bits, HuffmanBitWriter, os.path.join(tmp, 'bits'), codes),
+    }
+    size = os.path.getsize(in_file)
+    return {
+        'bytes': size,
+        'mode': 'binary' if binary else 'text',
+        'entropy': round(entropy(char_freq), 4),
+        'compressed_bytes': os.path.getsize(encoded_file),
+        'seconds': seconds,
+        'mb_per_s': {name: size / 1e6 / seconds[name]
+                     for name in ('cnt_freq', 'huffman_encode', 'huffman_decode')},
+        'mbit_per_s': {'read_bit': readBits / 1e6 / seconds['read_bit'],
+                       'write_bits': bits / 1e6 / seconds['write_bits']},
+    }
+
+
+GENERATED_INPUTS = (('low', 4, 2.0), ('text', 64, 1.0), ('high', 256, 0.0))   # name, symbols, skew
+
+
+def bench_suite(in_file, json_file='-', sizes='65536,1048576', repeats='3'):
+    '''Times cnt_freq, create_huff_tree, create_code, huffman_encode, huffman_decode, read_bit and
+    write_bits on in_file, declaration.txt and generated inputs of every size in sizes (comma
+    separated, in bytes) with low, text-like and high entropy, and writes the results as JSON to
+    json_file ('-' for standard output). Compare two result files with 'compare'.
+    Every input is deterministic, so results from two commits can be diffed directly'''
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in dict.fromkeys((in_file, 'declaration.txt')):
+            results[name] = measure_input(name, False, int(repeats), tmp)
+        for size in sizes.split(','):
+            for kind, symbols, skew in GENERATED_INPUTS:
+                path = os.path.join(tmp, 'generated.bin')
+                generate_input(path, int(size), symbols, skew)
+                results['generated-%s-%s' % (kind, size)] = measure_input(path, True, int(repeats), tmp)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+              'repeats': int(repeats), 'inputs': results}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if json_file == '-':
+        print(text)
+    else:
+        with open(json_file, 'w') as file:
+            file.write(text + '\n')
+
+
+def bench_compare(old_file, new_file, threshold='0.1'):
+    '''Prints the seconds of every layer and input in two result files of 'suite' side by side,
+    marking the ones that got more than threshold (a fraction) slower'''
+    with open(old_file) as file:
+        old = json.load(file)
+    with open(new_file) as file:
+        new = json.load(file)
+    print('%s (%s) -> %s (%s)' % (old_file, old['commit'], new_file, new['commit']))
+    print('  %-26s %-18s %12s %12s %8s' % ('input', 'layer', 'old ms', 'new ms', 'change'))
+    for name, result in new['inputs'].items():
+        if name not in old['inputs']:
+            continue
+        for layer, seconds in result['seconds'].items():
+            before = old['inputs'][name]['seconds'].get(layer)
+            if before is None:
+                continue
+            change = seconds / before - 1
+            flag = '  SLOWER' if change > float(threshold) else ''
+            print('  %-26s %-18s %12.3f %12.3f %+7.1f%%%s' % (name, layer, before * 1000, seconds * 1000,
+                                                             change * 100, flag))
+
+
+BENCHMARKS = {
+    'decode': bench_decode,
+    'encode_memory': bench_encode_memory,
+    'tree': bench_tree_build,
+    'blocks': bench_blocks,
+    'length_limit': bench_length_limit,
+    'count': bench_count,
+    'bit_io': bench_bit_io,
+    'table_cache': bench_table_cache,
+    'model': bench_model,
+    'text_output': bench_text_output,
+    'adaptive': bench_adaptive,
+    'tree_memory': bench_tree_memory,
+    'context': bench_context,
+    'symbols': bench_symbols,
+    'vectorize': bench_vectorize,
+    'verify': bench_verify,
+}
+
+# run by name only: they write or read JSON result files rather than printing a report
+HARNESS = {
+    'suite': bench_suite,
+    'compare': bench_compare,
+}
+
+
+if __name__ == '__main__':
+    # usage: python huffman_bench.py [benchmark name] [input file] [benchmark options]
+    # e.g. python huffman_bench.py blocks file_WAP.txt 1000  (block mode on ~1 GB)
+    # python huffman_bench.py suite file_WAP.txt results.json  (JSON results, see bench_suite)
+    # python huffman_bench.py compare old.json new.json
+    names = [sys.argv[1]] if len(sys.argv) > 1 else list(BENCHMARKS)
+    in_file = sys.argv[2] if len(sys.argv) > 2 else 'file_WAP.txt'
+    for name in names:
+        dict(BENCHMARKS, **HARNESS)[name](in_file, *sys.argv[3:])
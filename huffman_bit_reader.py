@@ -2,14 +2,16 @@
 #   Bit-packing reader and writer for Huffman encoder and decoder
 #
 
+import mmap
 import struct 
    
 # --------------------------------------------------------------------
 # HuffmanBitReader is a HuffmanBitReader(string)
 class HuffmanBitReader:
     # side effect: open a file with file name 'fname' for reading in binary mode
+    # (fname may also be a binary file object that is already open, e.g. io.BytesIO)
     def __init__(self, fname):
-        self.file = open(fname, 'rb')
+        self.file = fname if hasattr(fname, 'read') else open(fname, 'rb')
         self.n_bits = 0
         self.byte = 0
         self.mask = 0
@@ -36,8 +38,77 @@ class HuffmanBitReader:
         else:
             return True
          
+    # Use this method to read the encoded bits in bulk, as a bytes object of up to
+    # 'size' bytes (all remaining bytes when size is -1). Only call this on a byte
+    # boundary, i.e. after read_str and before any read_bit
+    def read_bytes(self, size=-1):
+        return self.file.read(size)
+
     # Reads a 1 byte from opened file and returns as unsigned int
     # You should not need to call this method
     def read_byte(self):
-        return struct.unpack('B', self.file.read(1))[0]  # 1 byte unsigned int      
+        return struct.unpack('B', self.file.read(1))[0]  # 1 byte unsigned int
+
+
+# --------------------------------------------------------------------
+# HuffmanMappedBitReader is a HuffmanMappedBitReader(string)
+# Drop-in replacement for HuffmanBitReader that memory-maps the whole file and reads
+# from it by position, with no file.read call or struct.unpack per byte
+class HuffmanMappedBitReader:
+    # side effect: memory-map the file with file name 'fname' for reading
+    def __init__(self, fname):
+        with open(fname, 'rb') as file:
+            try:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:     # an empty file cannot be mapped
+                self.map = None
+        self.data = memoryview(self.map) if self.map is not None else memoryview(b'')
+        self.pos = 0               # index of the next byte to read
+        self.byte = 0
+        self.mask = 0
+
+    # side effect: unmaps the file
+    def close(self):
+        self.data.release()
+        if self.map is not None:
+            self.map.close()
+
+    # Use this method to read the header from the compressed file.
+    def read_str(self):
+        end = self.map.find(b'\n', self.pos) + 1 if self.map is not None else 0
+        if end == 0:               # no newline: the header runs to the end of the file
+            end = len(self.data)
+        data = self.data[self.pos:end].tobytes()
+        self.pos = end
+        return data.decode('utf-8')
 
+    # Use this method to read a single bit from opened file
+    # It returns False if a 0 was read, True otherwise
+    def read_bit(self):
+        if self.mask == 0:     # all bits consumed, need to read in the next byte
+            try:
+                self.byte = self.data[self.pos]
+            except IndexError:
+                raise struct.error('unpack requires a buffer of 1 bytes') from None
+            self.pos += 1
+            self.mask = 1 << 7
+        bit = self.byte & self.mask
+        self.mask = self.mask >> 1
+        return bit != 0
+
+    # Use this method to read the encoded bits in bulk, as a bytes object of up to
+    # 'size' bytes (all remaining bytes when size is -1). Only call this on a byte
+    # boundary, i.e. after read_str and before any read_bit
+    def read_bytes(self, size=-1):
+        end = len(self.data) if size < 0 else min(self.pos + size, len(self.data))
+        data = self.data[self.pos:end].tobytes()
+        self.pos = end
+        return data
+
+    # Reads a 1 byte from opened file and returns as unsigned int
+    # You should not need to call this method
+    def read_byte(self):
+        if self.pos >= len(self.data):
+            raise struct.error('unpack requires a buffer of 1 bytes')
+        self.pos += 1
+        return self.data[self.pos - 1]
@@ -1,34 +1,126 @@
-import struct 
+
+import struct
 
 #   Bit-packing writer for Huffman encoder
 class HuffmanBitWriter:
+    BUFFER_SIZE = 1 << 16             # bytes collected before they are written to the file
+
     # side effect: open a file with file name 'fname' for writing in binary mode
+    # (fname may also be a binary file object that is already open, e.g. io.BytesIO)
     def __init__(self, fname):
-        self.file = open(fname, 'wb') # open a file with file name fname
+        self.file = fname if hasattr(fname, 'write') else open(fname, 'wb')
         self.n_bits = 0               # Number of accumulated bits so far
-        self.byte = 0                 # accumulated bits represented as byte 
+        self.bits = 0                 # accumulated bits represented as an integer (less than 64 bits)
+        self.buffer = bytearray()     # whole bytes waiting to be written to the file
 
-   # Use this method to close the compressed file 
+   # Use this method to close the compressed file
     def close(self):
+        self.flush()
+        self.file.close()
+
+    # Use this method to write everything so far to the file without closing it
+    def flush(self):
       # need to pad remaining bits in byte with 0s and write them to file
         if self.n_bits > 0:
-            self.byte = self.byte << (7-self.n_bits)
-            self.file.write(struct.pack('B', self.byte)) 
+            padding = -self.n_bits % 8
+            self.buffer += (self.bits << padding).to_bytes((self.n_bits + padding) // 8, 'big')
+            self.bits = 0
+            self.n_bits = 0
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+    # Use this method to write the header to the compressed file.
+    def write_str(self, str): # str is a string
+        self.buffer += str.encode('utf-8')
+
+    # Use this method to write a binary header (a bytes object) to the compressed file.
+    def write_bytes(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self.file.write(self.buffer)
+            self.buffer.clear()
+
+    # Use this method to write individual 0 and 1 bits to the compressed file
+    def write_code(self, code): # code is a string of '0's and '1's
+        if code:
+            self.write_bits(int(code, 2), len(code))
+
+    # Use this method to write the lowest 'length' bits of the integer 'code', most significant first
+    def write_bits(self, code, length):
+        self.bits = (self.bits << length) | code
+        self.n_bits += length
+        if self.n_bits >= 64:
+            spare = self.n_bits % 8
+            self.buffer += (self.bits >> spare).to_bytes(self.n_bits // 8, 'big')
+            self.bits &= (1 << spare) - 1
+            self.n_bits = spare
+            if len(self.buffer) >= self.BUFFER_SIZE:
+                self.file.write(self.buffer)
+                self.buffer.clear()
+
+
+#   Drop-in replacement for HuffmanBitWriter that collects the whole compressed file in one
+#   pre-sized bytearray and writes it with a single call when closed. Full 64-bit words are
+#   packed straight into the array with struct.pack_into, so no bytes object is made per write
+class HuffmanBufferBitWriter:
+    WORD = struct.Struct('>Q')
+
+    # side effect: open a file with file name 'fname' for writing in binary mode
+    # (fname may also be a binary file object that is already open, e.g. io.BytesIO)
+    # size_hint is the expected size of the compressed file in bytes (the array grows if needed)
+    def __init__(self, fname, size_hint=1 << 16):
+        self.file = fname if hasattr(fname, 'write') else open(fname, 'wb')
+        self.n_bits = 0               # Number of accumulated bits so far
+        self.bits = 0                 # accumulated bits represented as an integer (less than 64 bits)
+        self.buffer = bytearray(max(size_hint, 8))
+        self.pos = 0                  # number of bytes of buffer in use
+
+   # Use this method to close the compressed file
+    def close(self):
+        self.flush()
         self.file.close()
-      
-    # Use this method to write the header to the compressed file. 
+
+    # Use this method to write everything so far to the file without closing it
+    def flush(self):
+      # need to pad remaining bits in byte with 0s and write them to file
+        if self.n_bits > 0:
+            padding = -self.n_bits % 8
+            self.write_bytes((self.bits << padding).to_bytes((self.n_bits + padding) // 8, 'big'))
+            self.bits = 0
+            self.n_bits = 0
+        with memoryview(self.buffer) as view:
+            self.file.write(view[:self.pos])
+        self.pos = 0
+
+    # Use this method to write the header to the compressed file.
     def write_str(self, str): # str is a string
-        self.file.write(str.encode('utf-8'))
-   
-    # Use this method to write individual 0 and 1 bits to the compressed file  
+        self.write_bytes(str.encode('utf-8'))
+
+    # Use this method to write a binary header (a bytes object) to the compressed file.
+    def write_bytes(self, data):
+        self.reserve(len(data))
+        self.buffer[self.pos:self.pos + len(data)] = data
+        self.pos += len(data)
+
+    # Use this method to write individual 0 and 1 bits to the compressed file
     def write_code(self, code): # code is a string of '0's and '1's
-        for bit in code:
-            if bit == '1': self.byte += 1
-            if self.n_bits == 7:
-                self.file.write(struct.pack('B', self.byte)) 
-                self.byte = 0
-                self.n_bits = 0
-            else:
-                self.byte = self.byte << 1
-                self.n_bits += 1
-   
+        if code:
+            self.write_bits(int(code, 2), len(code))
+
+    # Use this method to write the lowest 'length' bits of the integer 'code', most significant first
+    def write_bits(self, code, length):
+        self.bits = (self.bits << length) | code
+        self.n_bits += length
+        while self.n_bits >= 64:
+            self.n_bits -= 64
+            if self.pos + 8 > len(self.buffer):
+                self.reserve(8)
+            self.WORD.pack_into(self.buffer, self.pos, self.bits >> self.n_bits)
+            self.pos += 8
+            self.bits &= (1 << self.n_bits) - 1
+
+    # Makes room for at least 'size' more bytes by doubling the array
+    # You should not need to call this method
+    def reserve(self, size):
+        if self.pos + size > len(self.buffer):
+            self.buffer.extend(bytes(max(len(self.buffer), self.pos + size - len(self.buffer))))
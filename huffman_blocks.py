@@ -0,0 +1,246 @@
+#
+#   Block mode: the input is split into fixed-size blocks of bytes that are Huffman coded
+#   independently (each with its own table), so they can be encoded and decoded on several
+#   cores at once. The blocks are stored in a seekable container:
+#
+#       MAGIC VERSION | block 0 | block 1 | ... | index | trailer
+#
+#   Each block is a complete stream in the canonical huffman_encode format (compact binary
+#   header followed by the encoded bits) over the bytes of that block. The index has one INDEX_ENTRY per block
+#   (file offset, size in bytes, number of decoded bytes, CRC32 of the encoded block) and the
+#   trailer at the very end of the file gives the offset of the index, the number of blocks and
+#   the CRC32 of the index.
+#
+#   Every block is checked against its size and CRC32 as it is read, before it is decoded, so a
+#   damaged container fails with ValueError at the first bad block. verify_blocks checks a whole
+#   container without decoding it, at the speed of reading the file. Version 1 containers
+#   (without CRC32s) can still be read.
+#
+#   The index makes the container seekable: decode_range decodes only the blocks holding the
+#   requested bytes, so the block size is also the granularity of random access.
+#
+
+import collections
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from huffman import BUFFER_SIZE, count_bytes, create_canonical_header, create_code_arrays, decode_chunks, \
+    encode_tables, pack_codes
+from huffman_bit_reader import HuffmanBitReader
+from huffman_bit_writer import HuffmanBitWriter
+
+MAGIC = b'HUFB'
+VERSION = 2
+BLOCK_SIZE = 1 << 20                   # bytes of input per block
+INDEX_ENTRY = struct.Struct('<QQQI')   # block offset, block size, decoded size, CRC32 of the block
+TRAILER = struct.Struct('<QQI4s')      # index offset, block count, CRC32 of the index, MAGIC
+V1_INDEX_ENTRY = struct.Struct('<QQQ') # the same in version 1 containers, without the CRC32s
+V1_TRAILER = struct.Struct('<QQ4s')
+RANGE_CHUNK_SIZE = 1 << 12             # encoded bytes decoded at a time by decode_range
+
+
+def encode_block(data):
+    '''Huffman codes one block of bytes and returns it as a standalone stream in the canonical
+    huffman_encode format. An empty block is an empty stream'''
+    if not data:
+        return b''
+    frequencies = count_bytes(data)
+    codeKey, codeBits, lengths = encode_tables(tuple(frequencies), True)
+    stream = io.BytesIO()
+    bitWriter = HuffmanBitWriter(stream)
+    bitWriter.write_bytes(create_canonical_header(lengths, len(data)))
+    codeArrays = create_code_arrays(codeBits)
+    if codeArrays is not None:
+        pack_codes(bitWriter, codeArrays, data)
+    else:
+        write_bits = bitWriter.write_bits
+        for byte in data:
+            write_bits(*codeBits[byte])
+    bitWriter.flush()
+    return stream.getvalue()
+
+
+def decode_block(block, limit=None):
+    '''Decodes one block written by encode_block and returns the original bytes.
+    If limit is given, decoding stops once at least limit bytes are available'''
+    chunkSize = BUFFER_SIZE if limit is None else RANGE_CHUNK_SIZE
+    decodedList = []
+    decodedSize = 0
+    for chunk in decode_chunks(HuffmanBitReader(io.BytesIO(block)), chunkSize):
+        decodedList.append(chunk)
+        decodedSize += len(chunk)
+        if limit is not None and decodedSize >= limit:
+            break
+    return "".join(decodedList).encode('latin-1')
+
+
+def map_bounded(function, items, workers, executor_class=ProcessPoolExecutor):
+    '''Like map(function, items) but runs on a pool of worker processes (or another
+    concurrent.futures executor_class), keeping at most two items per worker in flight so
+    that memory use stays bounded. Results come back in order. With one worker everything
+    runs in this process'''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(function, items)
+        return
+    with executor_class(workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_blocks(file, block_size):
+    '''Generator of successive blocks of block_size bytes read from an open binary file'''
+    data = file.read(block_size)
+    while data:
+        yield data
+        data = file.read(block_size)
+
+
+def encode_sized_block(data):
+    '''Returns (len(data), encode_block(data)); used by compress_blocks'''
+    return len(data), encode_block(data)
+
+
+def compress_blocks(in_file, out_file, block_size=BLOCK_SIZE, workers=None):
+    '''Compresses in_file into a block container out_file, encoding blocks of block_size bytes
+    on up to workers processes (default: one per CPU). Returns the number of blocks written.
+    in_file and out_file are file names or binary file objects; out_file need not be seekable,
+    so the container can be written to a pipe'''
+    if block_size <= 0:
+        raise ValueError("block_size must be positive")
+    if not hasattr(in_file, 'read'):
+        with open(in_file, 'rb') as source:
+            return compress_blocks(source, out_file, block_size, workers)
+    if not hasattr(out_file, 'write'):
+        with open(out_file, 'wb') as target:
+            return compress_blocks(in_file, target, block_size, workers)
+    out_file.write(MAGIC + bytes([VERSION]))
+    offset = len(MAGIC) + 1
+    index = []
+    for decodedSize, block in map_bounded(encode_sized_block, read_blocks(in_file, block_size), workers):
+        index.append(INDEX_ENTRY.pack(offset, len(block), decodedSize, zlib.crc32(block)))
+        out_file.write(block)
+        offset += len(block)
+    indexData = b''.join(index)
+    out_file.write(indexData)
+    out_file.write(TRAILER.pack(offset, len(index), zlib.crc32(indexData), MAGIC))
+    return len(index)
+
+
+def read_index(file):
+    '''Reads the block index of a container from an open binary file.
+    Returns a list of (offset, size, decoded size, CRC32) tuples, one per block (the CRC32 is None
+    in a version 1 container). Raises ValueError if the file is not a block container or its
+    trailer or index is damaged'''
+    file.seek(0)
+    start = file.read(len(MAGIC) + 1)
+    file.seek(0, io.SEEK_END)
+    end = file.tell()
+    if start[:len(MAGIC)] != MAGIC or end < len(start) + V1_TRAILER.size:
+        raise ValueError("not a Huffman block container")
+    version = start[len(MAGIC)]
+    if version not in (1, VERSION):
+        raise ValueError("unsupported block container version %d" % version)
+    entry, trailer = (V1_INDEX_ENTRY, V1_TRAILER) if version == 1 else (INDEX_ENTRY, TRAILER)
+    file.seek(end - trailer.size)
+    *fields, magic = trailer.unpack(file.read(trailer.size))
+    indexOffset, count = fields[:2]
+    if magic != MAGIC or indexOffset + count * entry.size != end - trailer.size:
+        raise ValueError("corrupt Huffman block container trailer")
+    file.seek(indexOffset)
+    data = file.read(count * entry.size)
+    if version > 1 and zlib.crc32(data) != fields[2]:
+        raise ValueError("corrupt Huffman block container index (CRC32 mismatch)")
+    index = [values + (None,) if version == 1 else values for values in entry.iter_unpack(data)]
+    offset = len(start)
+    for number, (blockOffset, size, decodedSize, crc) in enumerate(index):
+        if blockOffset != offset:
+            raise ValueError("corrupt Huffman block container index: block %d is misplaced" % number)
+        offset += size
+    if offset != indexOffset:
+        raise ValueError("corrupt Huffman block container index: the blocks do not end at the index")
+    return index
+
+
+def read_records(file, index):
+    '''Generator of the encoded blocks listed in index, read from an open binary file.
+    Each block is checked against its size and CRC32 before it is yielded'''
+    for offset, size, decoded, crc in index:
+        file.seek(offset)
+        block = file.read(size)
+        if len(block) != size:
+            raise ValueError("truncated Huffman block container: the block at offset %d is short" % offset)
+        if crc is not None and zlib.crc32(block) != crc:
+            raise ValueError("corrupt Huffman block container: the block at offset %d fails its CRC32"
+                             % offset)
+        yield block
+
+
+def verify_blocks(in_file):
+    '''Checks the block container in_file (a file name or a binary file object) without
+    decoding it: the trailer, the index and its CRC32, and the size and CRC32 of every block.
+    The blocks of a version 1 container have no CRC32, so they are decoded (and discarded)
+    instead. Returns the number of decoded bytes in the container; raises ValueError at the
+    first problem'''
+    if not hasattr(in_file, 'read'):
+        with open(in_file, 'rb') as source:
+            return verify_blocks(source)
+    if not in_file.seekable():
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(in_file, spool)
+            return verify_blocks(spool)
+    index = read_index(in_file)
+    for block, (offset, size, decodedSize, crc) in zip(read_records(in_file, index), index):
+        if crc is None and len(decode_block(block)) != decodedSize:
+            raise ValueError("corrupt Huffman block container: a block decodes to the wrong size")
+    return sum(entry[2] for entry in index)
+
+
+def decompress_blocks(in_file, out_file, workers=None):
+    '''Decompresses the block container in_file into out_file, decoding blocks on up to
+    workers processes (default: one per CPU). in_file and out_file are file names or binary file
+    objects. The index is at the end of the container, so an in_file that cannot seek (a pipe)
+    is first copied to a temporary file'''
+    if not hasattr(in_file, 'read'):
+        with open(in_file, 'rb') as source:
+            return decompress_blocks(source, out_file, workers)
+    if not hasattr(out_file, 'write'):
+        with open(out_file, 'wb') as target:
+            return decompress_blocks(in_file, target, workers)
+    if not in_file.seekable():
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(in_file, spool)
+            return decompress_blocks(spool, out_file, workers)
+    index = read_index(in_file)
+    for data in map_bounded(decode_block, read_records(in_file, index), workers):
+        out_file.write(data)
+
+
+def decode_range(in_file, start, length):
+    '''Returns (up to) length bytes of the original data starting at byte offset start,
+    decoding only the blocks of the container in_file that hold them'''
+    if start < 0 or length < 0:
+        raise ValueError("start and length must not be negative")
+    end = start + length
+    pieces = []
+    with open(in_file, 'rb') as source:
+        index = read_index(source)
+        blockStart = 0
+        for number, (offset, size, decodedSize, crc) in enumerate(index):
+            if blockStart >= end:
+                break
+            if blockStart + decodedSize > start:
+                block = next(read_records(source, index[number:number + 1]))
+                data = decode_block(block, end - blockStart)
+                pieces.append(data[max(start - blockStart, 0):end - blockStart])
+            blockStart += decodedSize
+    return b''.join(pieces)
@@ -0,0 +1,192 @@
+#
+#   Command-line front end, so the encoder can sit in a shell pipeline without temporary .txt
+#   files. Files are compressed or decompressed between any two paths, '-' (the default) being
+#   stdin or stdout:
+#
+#       python -m huffman_cli big.txt big.huf                  (one worker per CPU)
+#       tar c data | python -m huffman_cli -j 4 -b 4M > data.tar.huf
+#       python -m huffman_cli -d < data.tar.huf | tar x
+#       tail -f app.log | python -m huffman_cli --stream | ...   (adaptive, low latency)
+#
+#   Compression writes a block container (see huffman_blocks) whose blocks are coded on -j
+#   worker processes, or with --stream an adaptive stream (see huffman_stream) that is written
+#   as the input arrives. Decompression recognizes both by their first bytes, and decodes any
+#   other input as a file written by huffman_encode (as text, or with --binary as bytes). The
+#   data is streamed, except that a block container read from a pipe is first copied to a
+#   temporary file, as its index is at the end.
+#   With --stats the sizes, ratio, time and throughput are printed to stderr.
+#
+#   -t checks the integrity of the input instead, without writing any output (see verify):
+#
+#       python -m huffman_cli -t archive.huf || echo damaged
+#
+
+import argparse
+import contextlib
+import locale
+import os
+import sys
+from huffman import BUFFER_SIZE, SymbolModel, decode_chunks, read_header
+from huffman_bit_reader import HuffmanBitReader
+from huffman_blocks import BLOCK_SIZE, MAGIC as BLOCK_MAGIC, compress_blocks, decompress_blocks, verify_blocks
+from huffman_metrics import Metrics
+from huffman_stream import MAGIC as STREAM_MAGIC, SEGMENT_SIZE, adaptive_decode, adaptive_encode, verify_stream
+
+SIZE_SUFFIXES = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+def parse_size(text):
+    '''argparse type for sizes: a number of bytes with an optional K, M or G suffix (4M = 4 MiB)'''
+    multiplier = SIZE_SUFFIXES.get(text[-1:].lower(), 1)
+    try:
+        size = int(text[:-1] if multiplier > 1 else text) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size %r" % text) from None
+    if size <= 0:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return size
+
+
+def parse_workers(text):
+    '''argparse type for -j: a positive number of worker processes'''
+    try:
+        workers = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number of workers %r" % text) from None
+    if workers <= 0:
+        raise argparse.ArgumentTypeError("the number of workers must be positive")
+    return workers
+
+
+def open_file(path, mode):
+    '''Returns a context manager for path opened in binary mode 'rb' or 'wb'; '-' is stdin or
+    stdout, which are flushed but not closed'''
+    if path != '-':
+        return open(path, mode)
+    stream = sys.stdin.buffer if mode == 'rb' else sys.stdout.buffer
+    return contextlib.nullcontext(stream)
+
+
+def decode_single(source, target, binary=False):
+    '''Decompresses a file written by huffman_encode (any of its header formats) from source to
+    target. Like huffman_decode, the text is written in the locale's encoding, or with
+    binary=True (for files encoded with binary=True) as one byte per character. Symbol files
+    always hold text'''
+    reader = HuffmanBitReader(source)
+    headerInfo = read_header(reader)
+    if headerInfo is None:
+        return
+    if binary and not isinstance(headerInfo[0], SymbolModel):
+        encoding = 'latin-1'
+    else:
+        encoding = locale.getpreferredencoding(False)
+    for chunk in decode_chunks(reader, BUFFER_SIZE, headerInfo):
+        target.write(chunk.encode(encoding))
+
+
+def compress(source, target, args):
+    if args.stream:
+        adaptive_encode(source, target, args.block_size or SEGMENT_SIZE)
+    else:
+        compress_blocks(source, target, args.block_size or BLOCK_SIZE, args.workers)
+
+
+def decompress(source, target, args):
+    magic = source.peek(len(BLOCK_MAGIC))[:len(BLOCK_MAGIC)]
+    if magic == BLOCK_MAGIC:
+        decompress_blocks(source, target, args.workers)
+    elif magic == STREAM_MAGIC:
+        adaptive_decode(source, target)
+    else:
+        decode_single(source, target, args.binary)
+
+
+def verify(path):
+    '''Checks the integrity of the compressed file path ('-': stdin) without writing any output
+    and returns the number of bytes it decodes to. Block containers and adaptive streams are
+    checked against their CRCs without being decoded, so at about the speed of reading the file;
+    other files of huffman_encode have no checksum and are decoded (and the output discarded),
+    which catches a file cut short. Raises ValueError at the first problem found'''
+    with open_file(path, 'rb') as source:
+        magic = source.peek(len(BLOCK_MAGIC))[:len(BLOCK_MAGIC)]
+        if magic == BLOCK_MAGIC:
+            return verify_blocks(source)
+        if magic == STREAM_MAGIC:
+            return verify_stream(source)
+        return sum(len(chunk) for chunk in decode_chunks(HuffmanBitReader(source), BUFFER_SIZE))
+
+
+def print_stats(result, out=None):
+    '''Prints the sizes, ratio, time and throughput (MB/s of uncompressed data) of a Metrics result
+    to out (default: stderr)'''
+    original = result['bytes_in'] if result['operation'] == 'encode' else result['bytes_out']
+    seconds = result['seconds']
+    print('%s: %d -> %d bytes (ratio %s) in %.3f s, %.2f MB/s'
+          % ('compressed' if result['operation'] == 'encode' else 'decompressed', result['bytes_in'],
+             result['bytes_out'], '%.3f' % result['ratio'] if result['ratio'] is not None else '-',
+             seconds, original / seconds / 1e6 if seconds else 0.0), file=out or sys.stderr)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m huffman_cli',
+        description='Huffman compress or decompress INPUT into OUTPUT (both default to -, stdin/stdout).')
+    parser.add_argument('input', nargs='?', default='-', help='file to read (default: stdin)')
+    parser.add_argument('output', nargs='?', default='-', help='file to write (default: stdout)')
+    parser.add_argument('-d', '--decompress', action='store_true',
+                        help='decompress a block container, adaptive stream or huffman_encode file')
+    parser.add_argument('-j', '--workers', type=parse_workers, default=None,
+                        help='worker processes for block mode (default: one per CPU)')
+    parser.add_argument('-b', '--block-size', type=parse_size, default=None,
+                        help='bytes per block, e.g. 4M (default: %dM); with --stream, most bytes per '
+                             'segment (default: %dK)' % (BLOCK_SIZE >> 20, SEGMENT_SIZE >> 10))
+    parser.add_argument('--binary', action='store_true',
+                        help='with -d, write a file of huffman_encode(binary=True) byte for byte '
+                             'instead of as text in the locale encoding')
+    parser.add_argument('--stream', action='store_true',
+                        help='compress to an adaptive stream, written as the input arrives')
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help='print sizes, ratio and throughput to stderr')
+    parser.add_argument('-t', '--test', action='store_true',
+                        help='check the integrity of INPUT without writing any output')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='write compressed data to a terminal')
+    return parser
+
+
+def main(argv=None):
+    '''Runs the command line argv (default: sys.argv[1:]) and returns the exit status'''
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.stream and (args.decompress or args.workers is not None):
+        parser.error("--stream compresses in one process, it takes neither -d nor -j")
+    if args.test:
+        try:
+            size = verify(args.input)
+        except (OSError, ValueError) as error:
+            parser.exit(1, '%s: %s: %s\n' % (parser.prog, args.input, error))
+        if args.stats:
+            print('%s: OK, %d bytes' % (args.input, size), file=sys.stderr)
+        return 0
+    if not args.decompress and args.output == '-' and sys.stdout.isatty() and not args.force:
+        parser.error("compressed data not written to a terminal, use -f to force")
+    metrics = Metrics()
+    metrics.begin('decode' if args.decompress else 'encode')
+    try:
+        with open_file(args.input, 'rb') as source, open_file(args.output, 'wb') as target:
+            (decompress if args.decompress else compress)(metrics.wrap(source), metrics.wrap(target), args)
+            target.flush()
+    except BrokenPipeError:
+        # the reader went away (e.g. head): stop quietly, and keep Python from failing to flush
+        # stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (OSError, ValueError) as error:
+        parser.exit(1, '%s: error: %s\n' % (parser.prog, error))
+    if args.stats:
+        print_stats(metrics.finish())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
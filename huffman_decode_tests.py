@@ -1,6 +1,18 @@
 import unittest
 from huffman import *
+from huffman_bit_reader import HuffmanMappedBitReader
+from huffman_metrics import Metrics
+from huffman_async import AsyncHuffmanBitReader, AsyncHuffmanBitWriter, iter_decode_async
+from huffman_blocks import compress_blocks, decompress_blocks
+from huffman_stream import adaptive_encode, adaptive_decode
+from huffman_cli import main as cli_main, verify
+import asyncio
 import subprocess
+import os
+import struct
+import io
+import contextlib
+import tempfile
 
 class TestList(unittest.TestCase):
     def test_01a_test_file1_parse_header(self):
@@ -21,6 +33,297 @@ class TestList(unittest.TestCase):
         err = subprocess.call("diff -wb file1.txt file1_decoded.txt", shell = True)
         self.assertEqual(err, 0)
 
+    def test_02_test_file2_decode(self):
+        huffman_decode("file2_compressed_soln.txt", "file2_decoded.txt")
+        err = subprocess.call("diff -wb file2.txt file2_decoded.txt", shell = True)
+        self.assertEqual(err, 0)
+
+    def test_03_test_declaration_decode(self):
+        huffman_decode("declaration_compressed_soln.txt", "declaration_decoded.txt")
+        err = subprocess.call("diff -wb declaration.txt declaration_decoded.txt", shell = True)
+        self.assertEqual(err, 0)
+
+    def test_04_test_repeating_decode(self):
+        huffman_decode("repeating_soln.txt", "repeating_decoded.txt")
+        err = subprocess.call("diff -wb repeating.txt repeating_decoded.txt", shell = True)
+        self.assertEqual(err, 0)
+
+    def test_05_decode_table(self):
+        hufftree = create_huff_tree(cnt_freq("file2.txt"))
+        table = create_decode_table(hufftree)
+        self.assertEqual(len(table), 4 * 256)
+        # 1 1 1 0000 0 -> d d d a, ending part way into the next code (left of the root)
+        self.assertEqual(table[0b11100000], ('ddda', 1))
+        self.assertIsNone(create_decode_table(create_huff_tree(cnt_freq("repeating.txt"))))
+        self.assertEqual(create_array_decode_table(create_huff_arrays(cnt_freq("file2.txt"))), table)
+        self.assertIsNone(create_array_decode_table(create_huff_arrays(cnt_freq("repeating.txt"))))
+
+    def test_06_iter_decode(self):
+        with open("file1.txt") as file:
+            expected = file.read()
+        chunks = list(iter_decode("file1_compressed_soln.txt", chunk_size=2))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual("".join(chunks), expected)
+        self.assertEqual(list(iter_decode("repeating_soln.txt", chunk_size=2)), ["aa", "aa", "a"])
+        self.assertEqual(list(iter_decode("empty_file.txt")), [])
+        with self.assertRaises(FileNotFoundError):
+            iter_decode("nonexistent.txt")
+
+    def test_07_canonical_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("file1.txt", "file2.txt", "repeating.txt", "empty_file.txt", "declaration.txt"):
+                out_file = os.path.join(tmp, name.replace(".txt", "_out.txt"))
+                compressed = out_file.replace(".txt", "_compressed.txt")
+                decoded = os.path.join(tmp, name.replace(".txt", "_decoded.txt"))
+                huffman_encode(name, out_file, canonical=True)
+                huffman_decode(compressed, decoded)
+                err = subprocess.call("diff -wb " + name + " " + decoded, shell = True)
+                self.assertEqual(err, 0)
+            # 1 marker + 1 count + 1 pair count + 5 (char, length) pairs + 4 bytes of codes
+            self.assertEqual(os.path.getsize(os.path.join(tmp, "file1_out_compressed.txt")), 17)
+
+    def test_09_length_limited_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "declaration_out.txt")
+            decoded = os.path.join(tmp, "declaration_decoded.txt")
+            huffman_encode("declaration.txt", out_file, canonical=True, max_code_length=7)
+            with open(out_file) as file:
+                lengths = [int(length) for length in file.readline().split()[1::2]]
+            self.assertEqual(max(lengths), 7)
+            huffman_decode(out_file.replace(".txt", "_compressed.txt"), decoded)
+            err = subprocess.call("diff -wb declaration.txt " + decoded, shell = True)
+            self.assertEqual(err, 0)
+        with self.assertRaises(ValueError):
+            huffman_encode("declaration.txt", "declaration_out.txt", max_code_length=7)
+
+    def test_08_canonical_codes(self):
+        codes = create_canonical_codes([(97, 2), (98, 1), (99, 3), (100, 3)])
+        self.assertEqual(codes[98], (0b0, 1))
+        self.assertEqual(codes[97], (0b10, 2))
+        self.assertEqual(codes[99], (0b110, 3))
+        self.assertEqual(codes[100], (0b111, 3))
+        table = create_canonical_decode_table(codes)
+        self.assertEqual(table[0b01011011], ("bac", 2))
+        self.assertIsNone(create_canonical_decode_table(create_canonical_codes([(97, 0)])))
+
+    def test_10_binary_round_trip(self):
+        data = bytes(range(256)) * 3 + "naïve café – 日本語\r\n".encode("utf-8") * 50
+        with tempfile.TemporaryDirectory() as tmp:
+            in_file = os.path.join(tmp, "binary.txt")
+            with open(in_file, "wb") as file:
+                file.write(data)
+            with self.assertRaises(ValueError):
+                cnt_freq(in_file)
+            self.assertEqual(cnt_freq(in_file, buffer_size=100, binary=True), count_bytes(data))
+            for canonical in (False, True):
+                out_file = os.path.join(tmp, "binary_out.txt")
+                decoded = os.path.join(tmp, "binary_decoded.txt")
+                huffman_encode(in_file, out_file, canonical=canonical, binary=True)
+                huffman_decode(out_file.replace(".txt", "_compressed.txt"), decoded, binary=True)
+                with open(decoded, "rb") as file:
+                    self.assertEqual(file.read(), data)
+
+    def test_11_mapped_bit_reader(self):
+        readers = [HuffmanBitReader("file2_compressed_soln.txt"), HuffmanMappedBitReader("file2_compressed_soln.txt")]
+        self.assertEqual(readers[0].read_str(), readers[1].read_str())
+        for bit in range(16):
+            self.assertEqual(readers[0].read_bit(), readers[1].read_bit())
+        self.assertEqual(readers[0].read_bytes(), readers[1].read_bytes())
+        for reader in readers:
+            with self.assertRaises(struct.error):
+                reader.read_bit()
+            reader.close()
+        empty = HuffmanMappedBitReader("empty_file.txt")
+        self.assertEqual(empty.read_str(), "")
+        self.assertEqual(empty.read_bytes(), b"")
+        empty.close()
+
+    def test_12_table_caches(self):
+        clear_table_caches()
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "file1_out.txt")
+            decoded = os.path.join(tmp, "file1_decoded.txt")
+            for repeat in range(3):
+                huffman_encode("file1.txt", out_file)
+                huffman_decode(out_file.replace(".txt", "_compressed.txt"), decoded)
+            huffman_encode("file2.txt", out_file, canonical=True)
+        info = table_cache_info()
+        self.assertEqual((info["encode"].hits, info["encode"].misses), (2, 2))
+        self.assertEqual((info["decode"].hits, info["decode"].misses), (2, 1))
+        # context and symbol tables are much larger and only a few are kept
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "declaration_out.txt")
+            compressed = out_file.replace(".txt", "_compressed.txt")
+            decoded = os.path.join(tmp, "declaration_decoded.txt")
+            for options in ({"context": True}, {"symbols": "char"}, {"symbols": "word"}, {"symbols": "char"}):
+                huffman_encode("declaration.txt", out_file, text_output=False, **options)
+                huffman_decode(compressed, decoded)
+        info = table_cache_info()
+        self.assertEqual((info["decode_large"].hits, info["decode_large"].misses), (1, 3))
+        self.assertEqual(info["decode_large"].currsize, LARGE_CACHE_SIZE)
+        self.assertEqual(info["decode"].currsize, 1)
+        clear_table_caches()
+        self.assertEqual(table_cache_info()["encode"].currsize, 0)
+        self.assertEqual(table_cache_info()["decode_large"].currsize, 0)
+
+    def test_13_shared_model(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            model_file = os.path.join(tmp, "english.model")
+            save_model(train_model(["declaration.txt"]), model_file)
+            models.clear()
+            modelId = load_model(model_file)
+            out_file = os.path.join(tmp, "file1_out.txt")
+            compressed = out_file.replace(".txt", "_compressed.txt")
+            decoded = os.path.join(tmp, "file1_decoded.txt")
+            huffman_encode("file1.txt", out_file, model=modelId)
+            # 1 marker + 4 model id + 1 count + the encoded bits, no header
+            self.assertLess(os.path.getsize(compressed), 15)
+            huffman_decode(compressed, decoded)
+            err = subprocess.call("diff -wb file1.txt " + decoded, shell = True)
+            self.assertEqual(err, 0)
+            models.clear()
+            with self.assertRaises(ValueError):
+                huffman_decode(compressed, decoded)
+            with self.assertRaises(ValueError):
+                huffman_encode("file1.txt", out_file, model=modelId)
+
+    def test_14_async_decode(self):
+        async def collect(encoded_file, **options):
+            return [chunk async for chunk in iter_decode_async(encoded_file, **options)]
+        chunks = asyncio.run(collect("declaration_compressed_soln.txt", chunk_size=1000))
+        self.assertEqual(chunks, list(iter_decode("declaration_compressed_soln.txt", 1000)))
+        with open("file1.txt", "rb") as file:
+            self.assertEqual(asyncio.run(collect("file1_compressed_soln.txt", binary=True)), [file.read()])
+        async def round_trip(path):
+            writer = AsyncHuffmanBitWriter(path)
+            writer.write_str("2 1\n")
+            for piece in range(5000):
+                writer.write_bits(piece & 0x1f, 5)
+                if piece % 1000 == 0:
+                    await writer.drain()
+            await writer.close()
+            reader = AsyncHuffmanBitReader(path)
+            header = await reader.read_str()
+            data = await reader.read_bytes()
+            await reader.close()
+            return header, data
+        with tempfile.TemporaryDirectory() as tmp:
+            header, data = asyncio.run(round_trip(os.path.join(tmp, "bits.bin")))
+        self.assertEqual(header, "2 1\n")
+        bits = "".join(format(piece & 0x1f, "05b") for piece in range(5000))
+        self.assertEqual(data, int(bits, 2).to_bytes(len(bits) // 8, "big"))
+
+    def test_15_decode_metrics(self):
+        metrics = Metrics()
+        huffman_decode("declaration_compressed_soln.txt", "declaration_decoded.txt", metrics=metrics)
+        result = metrics.result
+        self.assertEqual(result["operation"], "decode")
+        self.assertEqual(set(result["stages"]), {"header", "tables", "read", "decode", "write"})
+        self.assertEqual(result["bytes_in"], os.path.getsize("declaration_compressed_soln.txt"))
+        self.assertEqual(result["bytes_out"], os.path.getsize("declaration_decoded.txt"))
+        self.assertEqual(result["stages"]["decode"]["bytes"], result["bytes_out"])
+        self.assertGreater(result["stages"]["decode"]["seconds"], 0)
+
+    def test_16_context_decode(self):
+        # after 'a' only 'b' and 'c' follow, after anything else only 'a' and 'c'
+        model = ContextModel(bytes([0] * 97 + [1] + [0] * 158), (((97, 1), (99, 1)), ((98, 1), (99, 1))))
+        table = create_context_decode_table(model)
+        self.assertEqual(len(table), 2 * 256)
+        # from context 0: 0 -> a, then table 1: 0 -> b, then table 0: 1 -> c, 1 -> c, 0 -> a, 0 -> b ...
+        self.assertEqual(table[0b00110000][0], "abccabab")
+        header = bytearray(create_context_header(model, 8))
+        self.assertEqual(parse_context_header(HuffmanBitReader(io.BytesIO(header[1:]))), (model, 8))
+        # a context pointing past the two tables, and the context bytes cut short
+        damaged = header[:3 + 97] + bytes([2]) + header[3 + 98:]
+        for data in (damaged[1:], header[1:100]):
+            with self.assertRaises(ValueError):
+                parse_context_header(HuffmanBitReader(io.BytesIO(data)))
+        with tempfile.TemporaryDirectory() as tmp:
+            compressed = os.path.join(tmp, "declaration_compressed.txt")
+            decoded = os.path.join(tmp, "declaration_decoded.txt")
+            huffman_encode("declaration.txt", os.path.join(tmp, "declaration.txt"), context=True)
+            huffman_decode(compressed, decoded)
+            err = subprocess.call("diff -wb declaration.txt " + decoded, shell = True)
+            self.assertEqual(err, 0)
+
+    def test_17_symbol_decode(self):
+        model = create_symbol_model({"the": 8, "é": 4, "世界": 2, " ": 2})
+        self.assertEqual(model, SymbolModel(("the", "é", " ", "世界"), (1, 2, 3, 3)))
+        header = create_symbol_header(model, 16)
+        reader = HuffmanBitReader(io.BytesIO(header[1:]))
+        self.assertEqual(parse_symbol_header(reader), (model, 16))
+        # damaged headers: codes too long, a huge count, an over-full and an incomplete code set,
+        # and a symbol cut short
+        tokens = header[7:]
+        for damaged in (bytes([16, 4, 40]), bytes([16, 4, 3]) + encode_varint(1 << 60) + bytes([1, 2]),
+                        bytes([16, 4, 3, 2, 1, 1]) + tokens, bytes([16, 3, 3, 1, 1, 1]) + tokens,
+                        header[1:-1]):
+            with self.assertRaises(ValueError):
+                parse_symbol_header(HuffmanBitReader(io.BytesIO(damaged)))
+        table = create_symbol_decode_table(model)
+        # codes 0, 10, 110 and 111; the table looks up 3 bits at a time
+        self.assertEqual(len(table), 8)
+        self.assertEqual(table[0b011], (chr(0), 1))
+        self.assertEqual(table[0b101], (chr(1), 2))
+        self.assertEqual(table[0b111], (chr(3), 3))
+        # 111 0 10 110 0000000 -> 世界 the é ' ' and seven times the
+        header = create_symbol_header(model, 11)
+        encoded = io.BytesIO(header + bytes([0b11101011, 0b00000000]))
+        self.assertEqual("".join(decode_chunks(HuffmanBitReader(encoded), 1)), "世界theé " + "the" * 7)
+        # the bits end before the 12th symbol: zero padding is not taken for codes
+        encoded = io.BytesIO(create_symbol_header(model, 12) + bytes([0b11101011, 0b00000000]))
+        with self.assertRaises(ValueError):
+            "".join(decode_chunks(HuffmanBitReader(encoded), 1))
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "declaration_out.txt")
+            compressed = os.path.join(tmp, "declaration_out_compressed.txt")
+            decoded = os.path.join(tmp, "declaration_decoded.txt")
+            for symbols in ("char", "word"):
+                huffman_encode("declaration.txt", out_file, symbols=symbols, text_output=False)
+                with open(compressed, "rb") as file:
+                    data = file.read()
+                for cut in (1, 2):
+                    with open(compressed, "wb") as file:
+                        file.write(data[:-cut])
+                    with self.assertRaises(ValueError):
+                        huffman_decode(compressed, decoded)
+
+    def test_18_integrity(self):
+        with open("declaration.txt", "rb") as file:
+            original = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            decoded = os.path.join(tmp, "declaration_decoded.txt")
+            container = os.path.join(tmp, "declaration.hufb")
+            stream = os.path.join(tmp, "declaration.hufs")
+            compress_blocks("declaration.txt", container, block_size=2000, workers=1)
+            adaptive_encode("declaration.txt", stream, segment_size=1000)
+            for path in (container, stream):
+                self.assertEqual(verify(path), len(original))
+                with open(path, "rb") as file:
+                    data = bytearray(file.read())
+                for damaged in (data[:len(data) // 2], data[:100] + bytes([data[100] ^ 4]) + data[101:]):
+                    with open(path, "wb") as file:
+                        file.write(damaged)
+                    with self.assertRaises(ValueError):
+                        verify(path)
+                    with self.assertRaises(ValueError):
+                        decompress_blocks(path, decoded) if path == container else adaptive_decode(path, decoded)
+            # files of huffman_encode have no checksum, but one cut short is caught
+            huffman_encode("declaration.txt", os.path.join(tmp, "declaration_out.txt"), canonical=True)
+            compressed = os.path.join(tmp, "declaration_out_compressed.txt")
+            self.assertEqual(verify(compressed), len(original.replace(b"\r\n", b"\n")))
+            with open(compressed, "rb") as file:
+                data = file.read()
+            # 4 bytes: the marker, the 2-byte character count and the pair count, but no pairs
+            for size in (3, 4, len(data) // 2):
+                with open(compressed, "wb") as file:
+                    file.write(data[:size])
+                with self.assertRaises(ValueError):
+                    huffman_decode(compressed, decoded)
+                with self.assertRaises(SystemExit) as cm, contextlib.redirect_stderr(io.StringIO()):
+                    cli_main(["-t", compressed])
+                self.assertEqual(cm.exception.code, 1)
+
     def compare_freq_counts(self, freq, exp):
         for i in range(256):
             stu = 'Frequency for ASCII ' + str(i) + ': ' + str(freq[i])
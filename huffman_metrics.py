@@ -0,0 +1,179 @@
+#
+#   Optional instrumentation for huffman_encode and huffman_decode. Pass a Metrics object as
+#   their metrics argument to record, per stage of the pipeline, the wall time, the number of
+#   calls and the bytes and bits processed (and, with trace_allocations=True, the memory
+#   allocated), plus the totals and the compression ratio of the whole operation:
+#
+#       metrics = Metrics(callback=send_to_monitoring)
+#       huffman_encode('big.txt', 'big_out.txt', text_output=False, metrics=metrics)
+#       metrics.result['stages']['pack']['seconds']
+#
+#   Stages nest, and the time of a stage does not include the stages run inside it: the time
+#   spent writing the compressed file is counted under 'write', not under 'pack' around it.
+#   Without a Metrics object the encoder and decoder use NO_METRICS, whose methods do nothing,
+#   and do not wrap their files, so the instrumentation costs a few calls per file.
+#
+
+import contextlib
+import time
+import tracemalloc
+
+
+class Metrics:
+    '''Records the stages of one encode or decode at a time (begin resets it). When the
+    operation is done, result holds the record as a dict of plain values (ready for json.dumps)
+    and callback, if given, is called with it'''
+
+    def __init__(self, callback=None, trace_allocations=False):
+        self.callback = callback
+        self.trace_allocations = trace_allocations
+        self.operation = None
+        self.stages = {}
+        self.result = None
+        self.stack = []            # seconds spent in child stages, one entry per open stage
+        self.started = 0.0
+        self.tracing = False       # True if begin started tracemalloc (and finish must stop it)
+
+    def begin(self, operation):
+        '''Starts recording operation ('encode' or 'decode')'''
+        self.operation = operation
+        self.stages = {}
+        self.result = None
+        self.stack = []
+        self.tracing = self.trace_allocations and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+
+    def entry(self, name):
+        '''Returns the record of stage name, creating it if needed'''
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'bits': 0}
+            if self.trace_allocations:
+                entry['allocated_bytes'] = 0
+        return entry
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''Context manager that adds the time spent in its body to stage name'''
+        entry = self.entry(name)
+        if self.trace_allocations:
+            before = tracemalloc.get_traced_memory()[0]
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            elapsed = time.perf_counter() - start
+            entry['seconds'] += elapsed - self.stack.pop()
+            entry['calls'] += 1
+            if self.stack:
+                self.stack[-1] += elapsed
+            if self.trace_allocations:
+                entry['allocated_bytes'] += tracemalloc.get_traced_memory()[0] - before
+
+    def count(self, name, bytes=0, bits=0):
+        '''Adds bytes and bits processed to stage name'''
+        entry = self.entry(name)
+        entry['bytes'] += bytes
+        entry['bits'] += bits
+
+    def wrap(self, file, stage=None):
+        '''Returns file wrapped so that its reads and writes are recorded as the stages 'read' and
+        'write' (or both as stage, if given)'''
+        return TimedFile(file, self, stage)
+
+    def finish(self):
+        '''Ends the operation: fills in result and calls the callback. The ratio is the size of
+        the compressed data over the size of the original, whichever way the operation went'''
+        seconds = time.perf_counter() - self.started
+        bytesIn = self.stages['read']['bytes'] if 'read' in self.stages else 0
+        bytesOut = self.stages['write']['bytes'] if 'write' in self.stages else 0
+        compressed, original = (bytesOut, bytesIn) if self.operation == 'encode' else (bytesIn, bytesOut)
+        self.result = {
+            'operation': self.operation,
+            'seconds': seconds,
+            'bytes_in': bytesIn,
+            'bytes_out': bytesOut,
+            'bits': sum(entry['bits'] for entry in self.stages.values()),
+            'ratio': compressed / original if original else None,
+            'stages': self.stages,
+        }
+        if self.trace_allocations:
+            self.result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        if self.callback is not None:
+            self.callback(self.result)
+        return self.result
+
+
+class NullMetrics:
+    '''Metrics that records nothing, used when no metrics object is given'''
+    stage_context = contextlib.nullcontext()
+
+    def begin(self, operation):
+        pass
+
+    def stage(self, name):
+        return self.stage_context
+
+    def count(self, name, bytes=0, bits=0):
+        pass
+
+    def wrap(self, file, stage=None):
+        return file
+
+    def finish(self):
+        pass
+
+
+NO_METRICS = NullMetrics()
+
+
+class TimedFile:
+    '''File wrapper that records the time and size of every read and write in a Metrics object'''
+
+    def __init__(self, file, metrics, stage=None):
+        self.file = file
+        self.metrics = metrics
+        self.readStage = stage or 'read'
+        self.writeStage = stage or 'write'
+
+    def read(self, size=-1):
+        with self.metrics.stage(self.readStage):
+            data = self.file.read(size)
+        self.metrics.count(self.readStage, len(data))
+        return data
+
+    def read1(self, size=-1):
+        with self.metrics.stage(self.readStage):
+            data = self.file.read1(size)
+        self.metrics.count(self.readStage, len(data))
+        return data
+
+    def readline(self):
+        with self.metrics.stage(self.readStage):
+            data = self.file.readline()
+        self.metrics.count(self.readStage, len(data))
+        return data
+
+    def write(self, data):
+        with self.metrics.stage(self.writeStage):
+            written = self.file.write(data)
+        self.metrics.count(self.writeStage, len(data))
+        return written
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __getattr__(self, name):
+        # anything else (seek, tell, peek, ...) goes to the file unrecorded
+        return getattr(self.file, name)
@@ -0,0 +1,217 @@
+#
+#   Adaptive (one-pass) Huffman coding for live streams such as pipes and sockets. There is no
+#   first pass to count frequencies: both sides start from the same flat model (every byte value
+#   counted once) and update it from the data as it goes by, so the encoder can send each piece
+#   of input as soon as it has read it and the decoder can rebuild the same model from what it
+#   has decoded. The stream is:
+#
+#       MAGIC VERSION rebuild_interval max_interval | segment | segment | ... | 0
+#
+#   A segment is the varint number of bytes it holds, the varint size of its payload, the
+#   payload (the bytes coded with the current model, padded to a whole byte) and the CRC-16
+#   (CCITT, see binascii.crc_hqx) of the segment up to there. A segment may be a single line of
+#   a log, so the check is 2 bytes rather than a CRC32. The encoder writes a segment for every read, so the latency is that
+#   of the source. A count of 0 ends the stream. The decoder checks every segment before it
+#   decodes it, and verify_stream checks them all without decoding. Version 1 streams have no
+#   checks and can still be decoded.
+#
+#   Rebuilding the decoding table takes tens of milliseconds, so the model is not rebuilt after
+#   every segment: the counts are updated after every segment but the code is rebuilt only after
+#   rebuild_interval more bytes, an interval that doubles after each rebuild up to max_interval.
+#   The decoding table is only rebuilt when the code lengths actually change. Counts are halved
+#   when their total passes AGE_LIMIT so the model follows the recent data.
+#
+
+import binascii
+import io
+import struct
+from huffman import count_bytes, create_canonical_codes, create_canonical_decode_table, \
+    create_code_arrays, create_code_lengths, encode_varint, pack_codes, read_varint
+from huffman_bit_reader import HuffmanBitReader
+from huffman_bit_writer import HuffmanBitWriter
+
+MAGIC = b'HUFS'
+VERSION = 2
+SEGMENT_CRC = struct.Struct('<H')   # CRC-16 of a segment's count, payload size and payload
+SEGMENT_SIZE = 1 << 16       # most bytes read from the source (and coded in a segment) at a time
+REBUILD_INTERVAL = 1 << 12   # bytes seen before the first rebuild of the code
+MAX_INTERVAL = 1 << 22       # most bytes seen between rebuilds
+AGE_LIMIT = 1 << 24          # total count above which all counts are halved
+
+
+class AdaptiveModel:
+    '''The model shared by adaptive_encode and adaptive_decode: byte counts and the canonical
+    code built from them. Both sides call update with the same data in the same order, so they
+    always agree on the code'''
+
+    def __init__(self, rebuild_interval=REBUILD_INTERVAL, max_interval=MAX_INTERVAL):
+        self.freqs = [1] * 256
+        self.interval = rebuild_interval
+        self.max_interval = max_interval
+        self.pending = 0          # bytes counted since the last rebuild
+        self.lengths = None
+        self.codeBits = None
+        self.codeArrays = None    # codeBits for pack_codes (None without NumPy)
+        self.table = None         # decoding table, built on first use
+        self.rebuild()
+
+    def update(self, data):
+        '''Counts the bytes of data and rebuilds the code if the interval has been reached'''
+        freqs = self.freqs
+        for char, count in enumerate(count_bytes(data)):
+            freqs[char] += count
+        self.pending += len(data)
+        if self.pending >= self.interval:
+            self.pending = 0
+            self.interval = min(self.interval * 2, self.max_interval)
+            if sum(freqs) > AGE_LIMIT:
+                self.freqs = [(freq + 1) // 2 for freq in freqs]
+            self.rebuild()
+
+    def rebuild(self):
+        '''Builds the code from the current counts, keeping the old one if the lengths are the same'''
+        lengths = create_code_lengths(self.freqs)
+        if lengths != self.lengths:
+            self.lengths = lengths
+            self.codeBits = create_canonical_codes(lengths)
+            self.codeArrays = create_code_arrays(self.codeBits)
+            self.table = None
+
+    def decode_table(self):
+        '''Returns the whole-byte decoding table of the current code'''
+        if self.table is None:
+            self.table = create_canonical_decode_table(self.codeBits)
+        return self.table
+
+
+def adaptive_encode(source, target, segment_size=SEGMENT_SIZE, rebuild_interval=REBUILD_INTERVAL,
+                    max_interval=MAX_INTERVAL):
+    '''Compresses everything read from source into an adaptive stream written to target, in one
+    pass. source and target are file names or binary file objects (e.g. sys.stdin.buffer or
+    socket.makefile('rb')). Each read of up to segment_size bytes is coded and written, and
+    target flushed, straight away. Returns the number of bytes compressed'''
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as file:
+            return adaptive_encode(file, target, segment_size, rebuild_interval, max_interval)
+    if not hasattr(target, 'write'):
+        with open(target, 'wb') as file:
+            return adaptive_encode(source, file, segment_size, rebuild_interval, max_interval)
+    read = getattr(source, 'read1', source.read)   # read1 returns what is there without waiting
+    model = AdaptiveModel(rebuild_interval, max_interval)
+    total = 0
+    target.write(MAGIC + bytes([VERSION]) + encode_varint(rebuild_interval) + encode_varint(max_interval))
+    data = read(segment_size)
+    while data:
+        stream = io.BytesIO()
+        bitWriter = HuffmanBitWriter(stream)
+        if model.codeArrays is not None:
+            pack_codes(bitWriter, model.codeArrays, data)
+        else:
+            write_bits = bitWriter.write_bits
+            codeBits = model.codeBits
+            for byte in data:
+                write_bits(*codeBits[byte])
+        bitWriter.flush()
+        payload = stream.getvalue()
+        segment = encode_varint(len(data)) + encode_varint(len(payload)) + payload
+        target.write(segment + SEGMENT_CRC.pack(binascii.crc_hqx(segment, 0)))
+        target.flush()
+        model.update(data)
+        total += len(data)
+        data = read(segment_size)
+    target.write(encode_varint(0))
+    target.flush()
+    return total
+
+
+def read_stream_header(reader):
+    '''Reads the start of an adaptive stream from reader and returns (version, AdaptiveModel).
+    Raises ValueError if it is not an adaptive stream'''
+    start = reader.read_bytes(len(MAGIC) + 1)
+    if start[:len(MAGIC)] != MAGIC or len(start) <= len(MAGIC):
+        raise ValueError("not an adaptive Huffman stream")
+    if start[len(MAGIC)] not in (1, VERSION):
+        raise ValueError("unsupported adaptive Huffman stream version %d" % start[len(MAGIC)])
+    return start[len(MAGIC)], AdaptiveModel(read_varint(reader), read_varint(reader))
+
+
+def read_segments(reader, version):
+    '''Generator of (count, payload) for the segments read from reader, up to the end of the
+    stream. Each segment is checked against its CRC (version 2) before it is yielded.
+    Raises ValueError if the stream is cut short or a segment is damaged'''
+    count = read_varint(reader)
+    while count > 0:
+        size = read_varint(reader)
+        payload = reader.read_bytes(size)
+        if len(payload) < size:
+            raise ValueError("truncated adaptive Huffman stream")
+        if version > 1:
+            crc = reader.read_bytes(SEGMENT_CRC.size)
+            if len(crc) < SEGMENT_CRC.size:
+                raise ValueError("truncated adaptive Huffman stream")
+            segment = encode_varint(count) + encode_varint(size) + payload
+            if SEGMENT_CRC.unpack(crc)[0] != binascii.crc_hqx(segment, 0):
+                raise ValueError("corrupt adaptive Huffman stream: a segment fails its CRC")
+        yield count, payload
+        count = read_varint(reader)
+
+
+def iter_adaptive_decode(source):
+    '''Generator of the decoded bytes of an adaptive stream read from source (a file name or a
+    binary file object), one segment at a time. Each segment is yielded as soon as it has been
+    read, so a consumer sees the data with the latency of the stream.
+    Raises ValueError if source is not an adaptive stream, or is cut short or damaged'''
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as file:
+            yield from iter_adaptive_decode(file)
+        return
+    reader = HuffmanBitReader(source)
+    yield from decode_segments(reader, *read_stream_header(reader))
+
+
+def decode_segments(reader, version, model):
+    '''Generator behind iter_adaptive_decode: decodes the segments read from reader after the
+    start of the stream, updating model as it goes'''
+    for count, payload in read_segments(reader, version):
+        table = model.decode_table()
+        state = 0
+        decodedList = []
+        for byte in payload:
+            chars, state = table[(state << 8) | byte]
+            decodedList.append(chars)
+        # the padding bits of the last byte may decode to extra characters, so cut at count
+        data = "".join(decodedList)[:count].encode('latin-1')
+        if len(data) < count:
+            raise ValueError("truncated adaptive Huffman stream")
+        yield data
+        model.update(data)
+
+
+def verify_stream(source):
+    '''Checks the adaptive stream read from source (a file name or a binary file object) without
+    decoding it: that it is complete and that every segment matches its CRC. A version 1
+    stream has no CRCs, so it is decoded (and the output discarded) instead.
+    Returns the number of decoded bytes in the stream; raises ValueError at the first problem'''
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as file:
+            return verify_stream(file)
+    reader = HuffmanBitReader(source)
+    version, model = read_stream_header(reader)
+    if version == 1:
+        return sum(len(data) for data in decode_segments(reader, version, model))
+    return sum(count for count, payload in read_segments(reader, version))
+
+
+def adaptive_decode(source, target):
+    '''Decompresses the adaptive stream read from source into target (file names or binary file
+    objects), writing and flushing each segment as it is decoded. Returns the number of bytes
+    written'''
+    if not hasattr(target, 'write'):
+        with open(target, 'wb') as file:
+            return adaptive_decode(source, file)
+    total = 0
+    for data in iter_adaptive_decode(source):
+        target.write(data)
+        target.flush()
+        total += len(data)
+    return total
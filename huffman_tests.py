@@ -1,7 +1,22 @@
 import unittest
 import subprocess
+import os
+import io
+import tempfile
+import asyncio
+import time
+import random
+import sys
 from ordered_list import *
 from huffman import *
+from huffman_blocks import *
+from huffman_bit_writer import HuffmanBufferBitWriter
+from huffman_batch import compress_files, compressed_name, decompress_files
+from huffman_async import huffman_encode_async, huffman_decode_async
+from huffman_stream import adaptive_encode, adaptive_decode, iter_adaptive_decode
+from huffman_metrics import Metrics
+import huffman_cli
+import tracemalloc
 
 
 class TestList(unittest.TestCase):
@@ -38,7 +53,60 @@ class TestList(unittest.TestCase):
         self.assertEqual(right.freq, 16)
         self.assertEqual(right.char, 100)
 
+    def test_create_huff_tree_large_alphabet(self):
+        freqlist = [1] * 65536
+        hufftree = create_huff_tree(freqlist)
+        self.assertEqual(hufftree.freq, 65536)
+        self.assertEqual(hufftree.char, 0)
+        # equal frequencies pair up in character order, so the lowest two characters are siblings
+        node = hufftree
+        while node.left.left is not None:
+            node = node.left
+        self.assertEqual((node.left.char, node.right.char), (0, 1))
       
+    def test_create_huff_arrays(self):
+        freqlist = cnt_freq("file2.txt")
+        left, right, root = create_huff_arrays(freqlist)
+        # 5 characters give 4 internal nodes, the root is made last
+        self.assertEqual((len(left), root), (4, 3))
+        self.assertEqual(right[root], ~ord('d'))
+        self.assertEqual(create_array_code((left, right, root)), create_code(create_huff_tree(freqlist)))
+        freqlist = cnt_freq("declaration.txt")
+        self.assertEqual(create_array_code(flatten_tree(create_huff_tree(freqlist))),
+                         create_array_code(create_huff_arrays(freqlist)))
+        self.assertEqual(create_huff_arrays(cnt_freq("repeating.txt"))[2], ~ord('a'))
+        self.assertFalse(hasattr(HuffmanNode(97, 2), "__dict__"))
+
+    def test_create_code_lengths(self):
+        freqlist = cnt_freq("declaration.txt")
+        codes = create_code(create_huff_tree(freqlist))
+        expected = [(char, len(codes[char])) for char in range(256) if freqlist[char]]
+        self.assertEqual(create_code_lengths(freqlist), expected)
+        self.assertEqual(create_code_lengths(freqlist, 32), expected)
+        # Fibonacci frequencies give a code as deep as the alphabet is large
+        fibonacci = [1, 1]
+        while len(fibonacci) < 40:
+            fibonacci.append(fibonacci[-1] + fibonacci[-2])
+        self.assertEqual(max(length for char, length in create_code_lengths(fibonacci)), 39)
+        lengths = create_code_lengths(fibonacci, 12)
+        self.assertEqual(max(length for char, length in lengths), 12)
+        self.assertEqual(sum(2 ** -length for char, length in lengths), 1)
+        with self.assertRaises(ValueError):
+            create_code_lengths(fibonacci, 5)
+        # a limit too small for the alphabet fails before any output file is written
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "declaration_out.txt")
+            for options in ({"canonical": True}, {"context": True}, {"symbols": "char"}):
+                with self.assertRaises(ValueError):
+                    huffman_encode("declaration.txt", out_file, max_code_length=3, **options)
+                self.assertEqual(os.listdir(tmp), [])
+            # outputs written when an error comes up are removed
+            with self.assertRaises(ValueError):
+                with open_outputs(os.path.join(tmp, "a.bin"), os.path.join(tmp, "a.txt")) as (bitWriter, outputFile):
+                    outputFile.write("0101")
+                    raise ValueError("failed")
+            self.assertEqual(os.listdir(tmp), [])
+
     def test_create_header(self):
         freqlist = cnt_freq("file2.txt")
         self.assertEqual(create_header(freqlist), "97 2 98 4 99 8 100 16 102 2")
@@ -79,6 +147,348 @@ class TestList(unittest.TestCase):
         #self.assertEqual(subprocess.call("fc file_WAP_compressed_soln.txt file_WAP_out_compressed.txt", shell=True), 0)  
         with self.assertRaises(FileNotFoundError):
             huffman_encode("nonexistent.txt", "nonexistent_out.txt")
+
+    def test_small_buffer_encode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "file2_out.txt")
+            huffman_encode("file2.txt", out_file, buffer_size=3)
+            self.assertEqual(cnt_freq("file2.txt", buffer_size=3), cnt_freq("file2.txt"))
+            self.assertEqual(subprocess.call("diff -wb " + out_file + " file2_soln.txt", shell = True), 0)
+            compressed = out_file.replace(".txt", "_compressed.txt")
+            self.assertEqual(subprocess.call("diff -wb " + compressed + " file2_compressed_soln.txt", shell = True), 0)
+
+    def test_blocks_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            container = os.path.join(tmp, "multiline.hufb")
+            decoded = os.path.join(tmp, "multiline_decoded.txt")
+            self.assertEqual(compress_blocks("multiline.txt", container, block_size=16, workers=2), 4)
+            with open(container, "rb") as file:
+                index = read_index(file)
+            self.assertEqual([entry[2] for entry in index], [16, 16, 16, 10])
+            decompress_blocks(container, decoded, workers=2)
+            with open("multiline.txt", "rb") as original, open(decoded, "rb") as result:
+                self.assertEqual(original.read(), result.read())
+            with self.assertRaises(ValueError):
+                decompress_blocks("file1_compressed_soln.txt", decoded)
+
+    def test_decode_range(self):
+        with open("declaration.txt", "rb") as file:
+            original = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            container = os.path.join(tmp, "declaration.hufb")
+            compress_blocks("declaration.txt", container, block_size=1000, workers=1)
+            for start, length in ((0, 10), (995, 10), (1500, 3000), (8380, 100), (9000, 5), (0, 0)):
+                self.assertEqual(decode_range(container, start, length), original[start:start + length])
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            names = ["file1.txt", "file2.txt", "declaration.txt", "nonexistent.txt"]
+            pairs = [(name, os.path.join(tmp, name.replace(".txt", "_out.txt"))) for name in names]
+            stats = compress_files(iter(pairs), workers=2, canonical=True)
+            self.assertEqual([result.in_file for result in stats], names)
+            self.assertIsNone(stats[0].error)
+            self.assertEqual((stats[0].bytes_in, stats[0].bytes_out), (13, 17))
+            self.assertLess(stats[2].ratio, 0.6)
+            self.assertIn("FileNotFoundError", stats[3].error)
+            self.assertFalse(os.path.exists(pairs[0][1]))
+            decoded = decompress_files([result.out_file for result in stats[:3]], workers=2, threads=True)
+            for name, result in zip(names, decoded):
+                self.assertIsNone(result.error)
+                self.assertTrue(result.out_file.endswith("_out_decoded.txt"))
+                self.assertEqual(subprocess.call("diff -wb " + name + " " + result.out_file, shell = True), 0)
+
+    def test_batch_model_and_names(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # the workers of a forkserver (or spawn) pool do not inherit registered models
+            script = ("import multiprocessing, sys\n"
+                      "from huffman import train_model, register_model\n"
+                      "from huffman_batch import compress_files, decompress_files\n"
+                      "if __name__ == '__main__':\n"
+                      "    multiprocessing.set_start_method('forkserver')\n"
+                      "    model = register_model(train_model(['declaration.txt']))\n"
+                      "    pairs = [('file1.txt', sys.argv[1] + '/file1.out'), ('file2.txt', sys.argv[1] + '/file2.out')]\n"
+                      "    stats = compress_files(pairs, workers=2, text_output=True, model=model)\n"
+                      "    stats += decompress_files([(result.out_file, result.out_file + '.dec') for result in stats], workers=2)\n"
+                      "    print([result.error for result in stats])\n")
+            process = subprocess.run([sys.executable, "-c", script, tmp], capture_output=True, text=True)
+            self.assertEqual(process.stdout.strip(), "[None, None, None, None]", process.stderr)
+            # the compressed name does not depend on a .txt extension
+            self.assertTrue(os.path.exists(os.path.join(tmp, "file1_compressed.out")))
+            self.assertTrue(os.path.exists(os.path.join(tmp, "file1.out")))
+            self.assertEqual(subprocess.call("diff -wb file1.txt " + os.path.join(tmp, "file1_compressed.out.dec"),
+                                             shell = True), 0)
+            self.assertEqual(compressed_name(os.path.join("a.txt.d", "out")), os.path.join("a.txt.d", "out_compressed"))
+            # huffman_encode names its files the same way, and never writes both to one path
+            huffman_encode("file1.txt", os.path.join(tmp, "out.bin"))
+            self.assertTrue(os.path.exists(os.path.join(tmp, "out.bin")))
+            huffman_decode(os.path.join(tmp, "out_compressed.bin"), os.path.join(tmp, "out.dec"))
+            self.assertEqual(subprocess.call("diff -wb file1.txt " + os.path.join(tmp, "out.dec"), shell = True), 0)
+            with self.assertRaises(ValueError):
+                encode_file("file1.txt", os.path.join(tmp, "same.bin"), os.path.join(tmp, "same.bin"))
+
+    def test_write_bits(self):
+        code = "1011" * 40 + "011"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bits.bin")
+            writer = HuffmanBitWriter(path)
+            writer.write_str("9 1\n")
+            for start in range(0, len(code), 7):
+                piece = code[start:start + 7]
+                writer.write_bits(int(piece, 2), len(piece))
+            writer.close()
+            with open(path, "rb") as file:
+                data = file.read()
+        self.assertEqual(data[:4], b"9 1\n")
+        padded = code + "0" * (-len(code) % 8)
+        self.assertEqual(data[4:], int(padded, 2).to_bytes(len(padded) // 8, "big"))
+
+    def test_buffer_bit_writer(self):
+        codeBits = create_code_bits(create_code(create_huff_tree(cnt_freq("declaration.txt"))))
+        with open("declaration.txt") as file:
+            text = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            outputs = []
+            for writer_class in (HuffmanBitWriter, HuffmanBufferBitWriter):
+                path = os.path.join(tmp, writer_class.__name__)
+                writer = writer_class(path)
+                writer.write_str(create_header(cnt_freq("declaration.txt")) + "\n")
+                for char in text:
+                    writer.write_bits(*codeBits[ord(char)])
+                writer.write_code("1" * 70)
+                writer.close()
+                with open(path, "rb") as file:
+                    outputs.append(file.read())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_no_text_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "file2_out.txt")
+            huffman_encode("file2.txt", out_file, text_output=False)
+            self.assertFalse(os.path.exists(out_file))
+            compressed = out_file.replace(".txt", "_compressed.txt")
+            self.assertEqual(subprocess.call("cmp " + compressed + " file2_compressed_soln.txt", shell = True), 0)
+            dump_code(compressed, out_file)
+            self.assertEqual(subprocess.call("diff -wb " + out_file + " file2_soln.txt", shell = True), 0)
+
+    def test_async_encode_loop_latency(self):
+        async def compress(in_file, out_file, decoded):
+            gaps = []
+            async def tick():
+                last = time.perf_counter()
+                while True:
+                    await asyncio.sleep(0.001)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+            ticker = asyncio.ensure_future(tick())
+            await huffman_encode_async(in_file, out_file, text_output=False)
+            encodeTicks = len(gaps)
+            await huffman_decode_async(out_file.replace(".txt", "_compressed.txt"), decoded)
+            ticker.cancel()
+            return encodeTicks, gaps
+        with tempfile.TemporaryDirectory() as tmp:
+            in_file = os.path.join(tmp, "big.txt")
+            with open("file_WAP.txt") as source, open(in_file, "w") as target:
+                target.write(source.read(1 << 20))
+            decoded = os.path.join(tmp, "big_decoded.txt")
+            encodeTicks, gaps = asyncio.run(compress(in_file, os.path.join(tmp, "big_out.txt"), decoded))
+            self.assertEqual(subprocess.call("cmp " + in_file + " " + decoded, shell = True), 0)
+        # the loop kept running while the file was compressed: it ticked many times, and never
+        # stalled for longer than scheduler jitter on a busy machine could explain
+        self.assertGreater(encodeTicks, 10)
+        self.assertLess(max(gaps), 0.5)
+
+    def test_adaptive_stream(self):
+        class Pipe(io.RawIOBase):
+            # a source that returns one line per read, like a pipe fed by a logger
+            def __init__(self, lines):
+                self.lines = lines
+            def readable(self):
+                return True
+            def readinto(self, buffer):
+                line = self.lines.pop(0) if self.lines else b''
+                buffer[:len(line)] = line
+                return len(line)
+        with open("declaration.txt", "rb") as file:
+            lines = file.read().splitlines(keepends=True)
+        writes = []
+        class Target(io.BytesIO):
+            def flush(self):
+                writes.append(self.tell())
+        target = Target()
+        self.assertEqual(adaptive_encode(Pipe(list(lines)), target, rebuild_interval=256), sum(map(len, lines)))
+        # every line was written out as soon as it was read, then the end marker
+        self.assertEqual(len(writes), len(lines) + 1)
+        self.assertLess(target.tell(), 0.7 * sum(map(len, lines)))
+        segments = list(iter_adaptive_decode(io.BytesIO(target.getvalue())))
+        self.assertEqual(segments, lines)
+        with tempfile.TemporaryDirectory() as tmp:
+            compressed = os.path.join(tmp, "multiline.hufs")
+            decoded = os.path.join(tmp, "multiline_decoded.txt")
+            adaptive_encode("multiline.txt", compressed, segment_size=7)
+            self.assertEqual(adaptive_decode(compressed, decoded), os.path.getsize("multiline.txt"))
+            self.assertEqual(subprocess.call("cmp multiline.txt " + decoded, shell = True), 0)
+            with self.assertRaises(ValueError):
+                adaptive_decode("file1_compressed_soln.txt", decoded)
+
+    def test_encode_metrics(self):
+        results = []
+        metrics = Metrics(callback=results.append, trace_allocations=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            out_file = os.path.join(tmp, "file2_out.txt")
+            huffman_encode("file2.txt", out_file, metrics=metrics)
+            compressed = os.path.getsize(out_file.replace(".txt", "_compressed.txt"))
+            text = os.path.getsize(out_file)
+        self.assertEqual(results, [metrics.result])
+        result = metrics.result
+        self.assertEqual(set(result["stages"]), {"count", "tables", "read", "pack", "write", "text"})
+        self.assertEqual((result["bytes_in"], result["bytes_out"]), (32, compressed))
+        self.assertEqual(result["ratio"], compressed / 32)
+        # 2 * 4 + 4 * 3 + 8 * 2 + 16 * 1 + 2 * 4 bits of code
+        self.assertEqual(result["bits"], 60)
+        self.assertEqual(result["stages"]["text"]["bytes"], text)
+        self.assertIn("peak_bytes", result)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_context_encode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            sizes = {}
+            for options in ({"canonical": True}, {"context": True}):
+                out_file = os.path.join(tmp, "declaration_out.txt")
+                compressed = out_file.replace(".txt", "_compressed.txt")
+                huffman_encode("declaration.txt", out_file, **options)
+                sizes[tuple(options)] = os.path.getsize(compressed)
+            with open(compressed, "rb") as file:
+                self.assertEqual(file.read(1)[0], CONTEXT_MARKER)
+            self.assertLess(sizes[("context",)], sizes[("canonical",)])
+            dump_file = os.path.join(tmp, "declaration_dump.txt")
+            dump_code(compressed, dump_file)
+            self.assertEqual(subprocess.call("cmp " + out_file + " " + dump_file, shell = True), 0)
+            # too small for several code tables to pay off: written as a canonical file
+            huffman_encode("file2.txt", out_file, context=True)
+            with open(compressed, "rb") as file:
+                self.assertIn(file.read(1)[0], (CANONICAL_PAIRS, CANONICAL_LENGTHS))
+            with self.assertRaises(ValueError):
+                huffman_encode("file2.txt", out_file, context=True, model=register_model(cnt_freq("file2.txt")))
+
+    def test_create_context_model(self):
+        pair_freq = cnt_pair_freq("declaration.txt")
+        self.assertEqual([sum(pair_freq[char::256]) for char in range(256)], cnt_freq("declaration.txt"))
+        model = create_context_model(pair_freq, 4)
+        self.assertEqual(len(model.lengths), 4)
+        self.assertEqual(model.groups[0], 0)
+        codeBits = create_context_codes(model)
+        # every character that follows a context has a code in that context's table
+        for pair, freq in enumerate(pair_freq):
+            if freq:
+                self.assertGreater(codeBits[pair][1], 0)
+
+    def test_symbol_encode(self):
+        text = "Grüße aus Köln! Привет, мир. 你好，世界。 🙂 naïve café\n" * 5
+        with tempfile.TemporaryDirectory() as tmp:
+            in_file = os.path.join(tmp, "unicode.txt")
+            with open(in_file, "w") as file:
+                file.write(text)
+            with self.assertRaises(ValueError):
+                cnt_freq(in_file)
+            out_file = os.path.join(tmp, "unicode_out.txt")
+            compressed = out_file.replace(".txt", "_compressed.txt")
+            decoded = os.path.join(tmp, "unicode_decoded.txt")
+            sizes = []
+            for symbols in ("char", "word"):
+                huffman_encode(in_file, out_file, symbols=symbols)
+                sizes.append(os.path.getsize(compressed))
+                huffman_decode(compressed, decoded)
+                with open(decoded) as file:
+                    self.assertEqual(file.read(), text)
+                dump_file = os.path.join(tmp, "unicode_dump.txt")
+                dump_code(compressed, dump_file)
+                self.assertEqual(subprocess.call("cmp " + out_file + " " + dump_file, shell = True), 0)
+            # the words repeated 5 times are symbols of their own
+            self.assertLess(sizes[1], sizes[0])
+            self.assertEqual(cnt_symbols(in_file, "word")["Привет"], 5)
+            # a large alphabet: every code point of the CJK block once
+            with open(in_file, "w") as file:
+                file.write("".join(map(chr, range(0x4E00, 0x9FA6))))
+            huffman_encode(in_file, out_file, symbols="char", text_output=False)
+            huffman_decode(compressed, decoded)
+            self.assertEqual(subprocess.call("cmp " + in_file + " " + decoded, shell = True), 0)
+            with self.assertRaises(ValueError):
+                huffman_encode(in_file, out_file, symbols="char", canonical=True)
+            with self.assertRaises(ValueError):
+                huffman_encode(in_file, out_file, symbols="bigram")
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_pack_codes(self):
+        random.seed(7)
+        for codeCount, maxLength in ((256, 1), (256, 17), (256, VECTOR_MAX_LENGTH), (65536, 12)):
+            codeBits = [(random.getrandbits(length), length) for length in
+                        (random.randint(1, maxLength) for _ in range(codeCount))]
+            data = bytes(random.getrandbits(8) for _ in range(5000))
+            previous = 200 if codeCount > 256 else None
+            outputs = []
+            for vectorize in (False, True):
+                stream = io.BytesIO()
+                writer = HuffmanBitWriter(stream)
+                writer.write_bits(0b1011, 4)   # pending bits go before the codes
+                if vectorize:
+                    pack_codes(writer, create_code_arrays(codeBits), data, previous)
+                else:
+                    context = previous
+                    for byte in data:
+                        writer.write_bits(*codeBits[byte if context is None else (context << 8) | byte])
+                        context = None if context is None else byte
+                writer.write_bits(0b101, 3)
+                writer.flush()
+                outputs.append(stream.getvalue())
+            self.assertEqual(outputs[0], outputs[1])
+        self.assertIsNone(create_code_arrays([(0, VECTOR_MAX_LENGTH + 1)] + [(0, 0)] * 255))
+        with tempfile.TemporaryDirectory() as tmp:
+            for options in ({}, {"canonical": True}, {"context": True}):
+                outputs = []
+                for vectorize in (False, True):
+                    out_file = os.path.join(tmp, "declaration_%s_out.txt" % vectorize)
+                    huffman_encode("declaration.txt", out_file, vectorize=vectorize, **options)
+                    for path in (out_file, out_file.replace(".txt", "_compressed.txt")):
+                        with open(path, "rb") as file:
+                            outputs.append(file.read())
+                self.assertEqual(outputs[:2], outputs[2:])
+
+    def test_cli(self):
+        with open("file2.txt", "rb") as file:
+            data = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            compressed = os.path.join(tmp, "file2.huf")
+            decoded = os.path.join(tmp, "file2.out")
+            for options in (["-j", "1", "-b", "64"], ["--stream", "-b", "1K"]):
+                self.assertEqual(huffman_cli.main(options + ["file2.txt", compressed]), 0)
+                self.assertEqual(huffman_cli.main(["-d", "-j", "1", compressed, decoded]), 0)
+                with open(decoded, "rb") as file:
+                    self.assertEqual(file.read(), data)
+            self.assertEqual(huffman_cli.parse_size("4M"), 4 << 20)
+            # a pipeline through stdin and stdout, stats on stderr
+            process = subprocess.run("%s -m huffman_cli -s < file2.txt | %s -m huffman_cli -d"
+                                     % (sys.executable, sys.executable), shell=True, capture_output=True)
+            self.assertEqual(process.stdout, data)
+            self.assertIn(b"compressed: %d -> " % len(data), process.stderr)
+            # files written by huffman_encode are recognized too
+            huffman_encode("file2.txt", os.path.join(tmp, "file2_out.txt"), canonical=True, text_output=False)
+            self.assertEqual(huffman_cli.main(["-d", os.path.join(tmp, "file2_out_compressed.txt"), decoded]), 0)
+            with open(decoded, "rb") as file:
+                self.assertEqual(file.read(), data.replace(b"\r\n", b"\n"))
+            # text is written in the locale encoding like huffman_decode, bytes with --binary
+            text = os.path.join(tmp, "cafe.txt")
+            with open(text, "w") as file:
+                file.write("café\n")
+            for binary in (False, True):
+                huffman_encode(text, os.path.join(tmp, "cafe_out.txt"), binary=binary, text_output=False)
+                options = ["--binary"] if binary else []
+                compressed = os.path.join(tmp, "cafe_out_compressed.txt")
+                self.assertEqual(huffman_cli.main(["-d"] + options + [compressed, decoded]), 0)
+                with open(decoded, "rb") as file, open(text, "rb") as original:
+                    self.assertEqual(file.read(), original.read())
+            with self.assertRaises(SystemExit):
+                huffman_cli.main([os.path.join(tmp, "missing.txt"), decoded])
+
     #Ordered list tests
     def setUp(self):
         self.list = OrderedList()